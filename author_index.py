@@ -0,0 +1,87 @@
+import random
+import bisect
+from datetime import datetime, timezone
+from typing import NoReturn
+
+# Scores are stored relative to a fixed epoch, so messages can be recorded in any order
+SCORE_EPOCH = datetime(2015, 1, 1, tzinfo=timezone.utc)
+
+
+class ChannelAuthors:
+    """The weighted authors of one channel."""
+    __slots__ = ("scores", "names", "cumulative_weights")
+
+    def __init__(self) -> NoReturn:
+        self.scores = {}
+        self.names = None
+        self.cumulative_weights = None
+
+
+class AuthorIndex:
+    """Keeps the active authors of each source channel, weighted by how many messages they sent and how recently,
+    so poll games can pick wrong answers without fetching more history.
+
+    Each message adds `2 ** (age / HALF_LIFE_DAYS)` to its author's score, measured from a fixed epoch, which weighs
+    a message half as much as one sent `HALF_LIFE_DAYS` later. Once a channel has more than
+    `MAX_AUTHORS_PER_CHANNEL` authors, the lowest scoring ones are dropped.
+
+    Attributes:
+        channels (dict[int, ChannelAuthors]): The authors of each channel, keyed by channel ID.
+    """
+    HALF_LIFE_DAYS = 30
+    MAX_AUTHORS_PER_CHANNEL = 500
+
+    def __init__(self) -> NoReturn:
+        self.channels = {}
+
+    def has_channel(self, channel_id: int) -> bool:
+        return channel_id in self.channels
+
+    def record(self, channel_id: int, author_name: str, created_at: datetime) -> NoReturn:
+        """Counts a message towards its author's score."""
+        authors = self.channels.get(channel_id)
+        if authors is None:
+            authors = self.channels[channel_id] = ChannelAuthors()
+        age_in_half_lives = (created_at - SCORE_EPOCH).total_seconds() / (self.HALF_LIFE_DAYS * 86400)
+        authors.scores[author_name] = authors.scores.get(author_name, 0.0) + 2 ** age_in_half_lives
+        authors.names = None
+        if len(authors.scores) > self.MAX_AUTHORS_PER_CHANNEL:
+            kept = sorted(authors.scores.items(), key=lambda item: item[1], reverse=True)
+            authors.scores = dict(kept[:int(self.MAX_AUTHORS_PER_CHANNEL * 0.9)])
+
+    def draw(self, channel_id: int, count: int, exclude: set[str]) -> list[str]:
+        """Draws up to `count` distinct authors of the channel in proportion to their scores, leaving out the
+        excluded ones. Fewer than `count` authors are only returned if the channel doesn't have enough others.
+
+        The cumulative weights are rebuilt only after the channel's authors have changed, so each draw takes
+        O(log n) time. If the excluded authors hold most of the weight, draws keep landing on them, so the remaining
+        authors are then drawn from directly in O(n) time.
+        """
+        authors = self.channels.get(channel_id)
+        if authors is None:
+            return []
+        if authors.names is None:
+            authors.names = list(authors.scores)
+            total = 0.0
+            authors.cumulative_weights = []
+            for name in authors.names:
+                total += authors.scores[name]
+                authors.cumulative_weights.append(total)
+
+        drawn = []
+        eligible = len(authors.names) - len(exclude & authors.scores.keys())
+        for _ in range(count * 10):
+            if len(drawn) >= min(count, eligible):
+                break
+            value = random.uniform(0, authors.cumulative_weights[-1])
+            index = min(bisect.bisect_left(authors.cumulative_weights, value), len(authors.names) - 1)
+            name = authors.names[index]
+            if name not in exclude and name not in drawn:
+                drawn.append(name)
+
+        remaining = [name for name in authors.names if name not in exclude and name not in drawn]
+        while remaining and len(drawn) < count:
+            name = random.choices(remaining, [authors.scores[name] for name in remaining])[0]
+            drawn.append(name)
+            remaining.remove(name)
+        return drawn
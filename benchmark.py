@@ -0,0 +1,319 @@
+"""Offline benchmark of the bot's commands against an in-process fake of Discord.
+
+Runs $ranmsg, $whosentit and the toggle commands against synthetic channel histories and reports latency, REST calls
+per command, retries and event loop blocking as JSON, so runs before and after a change can be compared.
+
+Usage: python benchmark.py --messages 50000 --commands 200 --concurrency 10 --output bench.json
+"""
+import os
+import json
+import time
+import random
+import asyncio
+import argparse
+import tempfile
+from collections import Counter
+from datetime import datetime, timezone, timedelta
+from bisect import bisect_left, bisect_right
+from bot_main import Bot
+from metrics import HISTORY_FETCH_LATENCY, EMPTY_WINDOWS, RETRIES
+from constants import KEY_SELECT_FROM, KEY_SEND_TO, KEY_START_DATE
+
+
+class FakeBackend:
+    """Counts the REST calls made against the fake and simulates their latency."""
+    def __init__(self, api_latency: float) -> None:
+        self.api_latency = api_latency
+        self.rest_calls = Counter()
+        self.next_id = 10 ** 17
+
+    async def request(self, route: str) -> None:
+        self.rest_calls[route] += 1
+        if self.api_latency:
+            await asyncio.sleep(self.api_latency)
+
+    def new_id(self) -> int:
+        self.next_id += 1
+        return self.next_id
+
+
+class FakeUser:
+    def __init__(self, user_id: int, name: str) -> None:
+        self.id = user_id
+        self.name = name
+        self.bot = False
+
+    def __str__(self) -> str:
+        return self.name
+
+
+class FakeAttachment:
+    def __init__(self, url: str) -> None:
+        self.url = url
+
+
+class FakeGuild:
+    def __init__(self, guild_id: int, name: str, me: FakeUser) -> None:
+        self.id = guild_id
+        self.name = name
+        self.me = me
+
+
+class FakeMessage:
+    def __init__(self, backend: FakeBackend, message_id: int, channel: "FakeChannel", author: FakeUser, content: str,
+                 created_at: datetime, attachments: list = (), mentions: list = (), channel_mentions: list = ()) -> None:
+        self.backend = backend
+        self.id = message_id
+        self.channel = channel
+        self.guild = channel.guild
+        self.author = author
+        self.content = content
+        self.created_at = created_at
+        self.attachments = list(attachments)
+        self.mentions = list(mentions)
+        self.role_mentions = []
+        self.mention_everyone = False
+        self.channel_mentions = list(channel_mentions)
+
+    async def edit(self, content: str) -> None:
+        await self.backend.request("PATCH /channels/{channel_id}/messages/{message_id}")
+        self.content = content
+
+    async def add_reaction(self, emoji: str) -> None:
+        await self.backend.request("PUT /channels/{channel_id}/messages/{message_id}/reactions/{emoji}/@me")
+
+
+class FakeChannel:
+    """A text channel whose history is served from a sorted list, one REST call per page of 100 messages."""
+    def __init__(self, backend: FakeBackend, channel_id: int, name: str, guild: FakeGuild) -> None:
+        self.backend = backend
+        self.id = channel_id
+        self.name = name
+        self.guild = guild
+        self.messages = []
+        self.message_ids = []
+        self.message_times = []
+        self.sent = 0
+
+    def __str__(self) -> str:
+        return f"#{self.name}"
+
+    async def send(self, content: str) -> FakeMessage:
+        await self.backend.request("POST /channels/{channel_id}/messages")
+        self.sent += 1
+        return FakeMessage(self.backend, self.backend.new_id(), self, self.guild.me, content,
+                           datetime.now(timezone.utc))
+
+    def index_history(self) -> None:
+        """Indexes the generated history by ID and creation time."""
+        self.message_ids = [message.id for message in self.messages]
+        self.message_times = [message.created_at for message in self.messages]
+
+    async def history(self, limit=100, before=None, after=None, around=None, oldest_first=None):
+        ids = self.message_ids
+        if around is not None:
+            await self.backend.request("GET /channels/{channel_id}/messages")
+            index = bisect_left(self.message_times, around)
+            half = (limit or 100) // 2
+            for message in self.messages[max(index - half, 0):index + half]:
+                yield message
+            return
+
+        start = bisect_right(ids, after.id) if after is not None else 0
+        end = bisect_left(ids, before.id) if before is not None else len(ids)
+        window = self.messages[start:end]
+        if not oldest_first and after is None:
+            window = window[::-1]
+        if limit is not None:
+            window = window[:limit]
+        for page_start in range(0, len(window), 100):
+            await self.backend.request("GET /channels/{channel_id}/messages")
+            for message in window[page_start:page_start + 100]:
+                yield message
+
+
+def generate_history(backend: FakeBackend, channel: FakeChannel, authors: list[FakeUser], size: int, days: int,
+                     burstiness: float, url_ratio: float, attachment_ratio: float, mention_ratio: float) -> None:
+    """Fills the channel with `size` messages over `days` days, a `burstiness` share of them in a few bursts."""
+    now = datetime.now(timezone.utc)
+    start = now - timedelta(days=days)
+    bursts = [start + timedelta(seconds=random.uniform(0, days * 86400)) for _ in range(max(days // 30, 1))]
+    times = []
+    for _ in range(size):
+        if random.random() < burstiness:
+            times.append(random.choice(bursts) + timedelta(seconds=random.expovariate(1 / 3600)))
+        else:
+            times.append(start + timedelta(seconds=random.uniform(0, days * 86400)))
+    times = sorted(min(time_, now) for time_ in times)
+
+    weights = [1 / (rank + 1) for rank in range(len(authors))]
+    for created_at in times:
+        author = random.choices(authors, weights)[0]
+        content = f"message {random.randint(0, 10 ** 6)}"
+        if random.random() < url_ratio:
+            content += " https://example.com/page"
+        attachments = [FakeAttachment("https://cdn.example.com/file.png")] if random.random() < attachment_ratio else []
+        mentions = [random.choice(authors)] if random.random() < mention_ratio else []
+        channel.messages.append(FakeMessage(backend, backend.new_id(), channel, author, content, created_at,
+                                            attachments, mentions))
+    channel.index_history()
+
+
+class BenchmarkBot(Bot):
+    """The real bot, with the gateway cache and REST calls served by the fake backend."""
+    def __init__(self, backend: FakeBackend, bot_user: FakeUser, guilds: list, channels: dict,
+                 cold_gateway: bool) -> None:
+        self.backend = backend
+        self.bot_user = bot_user
+        self.fake_guilds = guilds
+        self.fake_channels = channels
+        self.cold_gateway = cold_gateway
+        super().__init__("benchmark")
+
+    @property
+    def user(self):
+        return self.bot_user
+
+    @property
+    def guilds(self):
+        return self.fake_guilds
+
+    def get_channel(self, channel_id: int):
+        return None if self.cold_gateway else self.fake_channels.get(int(channel_id))
+
+    async def fetch_channel(self, channel_id: int):
+        await self.backend.request("GET /channels/{channel_id}")
+        return self.fake_channels[int(channel_id)]
+
+
+async def monitor_loop_lag(samples: list, interval: float = 0.01) -> None:
+    """Records how much later than requested the event loop wakes up a sleeping task."""
+    loop = asyncio.get_running_loop()
+    while True:
+        start = loop.time()
+        await asyncio.sleep(interval)
+        samples.append(max(loop.time() - start - interval, 0.0))
+
+
+def percentile(values: list[float], fraction: float) -> float:
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[min(int(len(ordered) * fraction), len(ordered) - 1)]
+
+
+async def run_benchmark(args: argparse.Namespace) -> dict:
+    random.seed(args.seed)
+    backend = FakeBackend(args.api_latency)
+    bot_user = FakeUser(1, "bot")
+    authors = [FakeUser(100 + i, f"user{i}") for i in range(args.authors)]
+    guild = FakeGuild(2, "benchmark guild", bot_user)
+    source = FakeChannel(backend, 3, "source", guild)
+    destination = FakeChannel(backend, 4, "destination", guild)
+    generate_history(backend, source, authors, args.messages, args.days, args.burstiness, args.url_ratio,
+                     args.attachment_ratio, args.mention_ratio)
+
+    bot = BenchmarkBot(backend, bot_user, [guild], {source.id: source, destination.id: destination}, args.cold_gateway)
+    bot.config_manager.reconcile_guilds()
+    config = bot.config_manager.server_configs[str(guild.id)]
+    config[KEY_SELECT_FROM], config[KEY_SEND_TO] = str(source.id), str(destination.id)
+    config[KEY_START_DATE] = str(source.messages[0].created_at)
+    if not args.rate_limit:
+        bot.commands.rate_limiter.GUILD_CAPACITY = bot.commands.rate_limiter.USER_CAPACITY = float("inf")
+    if args.archive:
+        bot.message_archive.start_backfill(source)
+        await bot.message_archive.backfill_tasks[source.id]
+
+    def window_counts() -> tuple[int, float, float]:
+        fetches = sum(HISTORY_FETCH_LATENCY.count(source=source) for source in ("archive", "history"))
+        return fetches, EMPTY_WINDOWS.total(), RETRIES.total()
+
+    lag_samples = []
+    lag_monitor = asyncio.create_task(monitor_loop_lag(lag_samples))
+    semaphore = asyncio.Semaphore(args.concurrency)
+    results = {}
+    commands = {"$ranmsg": "$ranmsg", "$whosentit": f"$whosentit {args.poll_duration}",
+                "toggles": None}
+
+    for name, content in commands.items():
+        latencies = []
+        backend.rest_calls.clear()
+        fetches_before, empty_before, retries_before = window_counts()
+
+        async def run_one(index: int) -> None:
+            command = content or random.choice(["$urls", "$attachments", "$mentions"])
+            message = FakeMessage(backend, backend.new_id(), destination, authors[index % len(authors)], command,
+                                  datetime.now(timezone.utc))
+            async with semaphore:
+                start = time.perf_counter()
+                await bot.on_message(message)
+                latencies.append(time.perf_counter() - start)
+
+        started = time.perf_counter()
+        await asyncio.gather(*(run_one(index) for index in range(args.commands)))
+        elapsed = time.perf_counter() - started
+        if name == "$whosentit":
+            await asyncio.sleep(args.poll_duration + 1)
+        results[name] = {
+            "commands": args.commands,
+            "p50_ms": percentile(latencies, 0.5) * 1000,
+            "p99_ms": percentile(latencies, 0.99) * 1000,
+            "throughput_per_s": args.commands / elapsed if elapsed else 0.0,
+            "rest_calls_per_command": sum(backend.rest_calls.values()) / args.commands,
+            "rest_calls_by_route": dict(backend.rest_calls),
+            "history_fetches": window_counts()[0] - fetches_before,
+            "empty_windows": window_counts()[1] - empty_before,
+            "retries": window_counts()[2] - retries_before,
+        }
+
+    lag_monitor.cancel()
+    await bot.shutdown_components()
+    return {
+        "parameters": vars(args),
+        "results": results,
+        "event_loop": {"max_lag_ms": max(lag_samples, default=0.0) * 1000,
+                       "p99_lag_ms": percentile(lag_samples, 0.99) * 1000,
+                       "blocked_ms": sum(lag for lag in lag_samples if lag > 0.005) * 1000},
+        "channel_resolver": bot.channel_resolver.stats(),
+    }
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--messages", type=int, default=20000, help="number of messages in the source channel")
+    parser.add_argument("--days", type=int, default=730, help="time span of the source channel's history")
+    parser.add_argument("--authors", type=int, default=50, help="number of distinct authors")
+    parser.add_argument("--burstiness", type=float, default=0.7, help="share of messages sent in bursts")
+    parser.add_argument("--url-ratio", type=float, default=0.2)
+    parser.add_argument("--attachment-ratio", type=float, default=0.1)
+    parser.add_argument("--mention-ratio", type=float, default=0.1)
+    parser.add_argument("--commands", type=int, default=100, help="number of commands of each kind to run")
+    parser.add_argument("--concurrency", type=int, default=10)
+    parser.add_argument("--api-latency", type=float, default=0.05, help="simulated REST latency in seconds")
+    parser.add_argument("--poll-duration", type=int, default=1)
+    parser.add_argument("--archive", action="store_true", help="backfill the message archive before running")
+    parser.add_argument("--cold-gateway", action="store_true", help="make every channel miss the gateway cache")
+    parser.add_argument("--rate-limit", action="store_true", help="keep the command rate limits enabled")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", help="file to write the JSON report to instead of stdout")
+    args = parser.parse_args()
+    if args.output:
+        args.output = os.path.abspath(args.output)
+
+    working_directory = os.getcwd()
+    with tempfile.TemporaryDirectory() as directory:
+        os.chdir(directory)
+        try:
+            report = asyncio.run(run_benchmark(args))
+        finally:
+            os.chdir(working_directory)
+    report_json = json.dumps(report, indent=2, default=str)
+    if args.output:
+        with open(args.output, "w") as file:
+            file.write(report_json)
+    else:
+        print(report_json)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,19 +1,23 @@
+import os
+import time
+import asyncio
 import discord
 import logging
-from typing import NoReturn
+from typing import NoReturn, Optional
 from poll_games import PollGames
 from config_manager import ConfigManager
 from random_message import RandomMessage
 from commands_manager import Commands
 from helper_funcs import HelperFuncs
-
-
-logging.basicConfig(
-    filename="logs.txt",
-    level=logging.INFO,
-    format='%(asctime)s - %(levelname)s - Module: %(module)s - Function: %(funcName)s \n\tMessage: %(message)s',
-    datefmt='%Y-%m-%d %H:%M:%S'
-)
+from message_archive import MessageArchive
+from message_histogram import HistogramStore
+from candidate_pool import CandidatePool
+from channel_resolver import ChannelResolver
+from countdown_scheduler import CountdownScheduler
+from author_index import AuthorIndex
+from post_scheduler import PostScheduler
+from metrics import MetricsServer, instrument_http, monitor_event_loop_lag, STARTUP_PHASE_SECONDS
+from constants import KEY_SELECT_FROM
 
 
 class Bot(discord.Client):
@@ -27,43 +31,214 @@ class Bot(discord.Client):
         config_manager (ConfigManager): Manages server-specific configurations.
         random_message (RandomMessage): Handles fetching and sending random messages.
         commands (Commands): Processes and responds to user commands.
+        message_archive (MessageArchive): Keeps a local copy of the source channels' history.
+        histograms (HistogramStore): Estimates when messages were sent in the source channels.
+        candidate_pool (CandidatePool): Prefetches candidate messages for every guild.
+        channel_resolver (ChannelResolver): Resolves channel IDs without REST calls when possible.
+        countdown_scheduler (CountdownScheduler): Updates the countdowns of every active poll.
+        author_index (AuthorIndex): Keeps the active authors of the source channels.
+        post_scheduler (PostScheduler): Posts random messages in the guilds that scheduled them.
+        startup_timings (dict[str, float]): How long each phase of the startup took, in seconds.
+        low_memory (bool): Whether the bot runs in low-memory mode, with minimal discord.py caches and smaller
+            bounds on its own caches.
+        worker_index (Optional[int]): The index of the worker process running the bot, if it runs in one.
     """
-    def __init__(self, token: str) -> NoReturn:
-        """Initializes the bot with necessary configurations and permissions. """
+    CONFIG_BACKEND = None
+
+    def __init__(self, token: str, worker_index: Optional[int] = None, **client_options) -> NoReturn:
+        """Initializes the bot with necessary configurations and permissions.
+
+        Args:
+            token (str): The Discord bot token used for authentication.
+            worker_index (Optional[int]): The index of the worker process running the bot, which gets its own
+                histogram file and metrics port.
+            **client_options: Passed on to the discord.py client, e.g. `shard_ids` and `shard_count`.
+        """
         intents = discord.Intents.default()
         intents.message_content = True
         intents.members = True
-        super().__init__(intents=intents)
+        self.low_memory = os.environ.get("MEMORY_MODE", "default") == "low"
+        if self.low_memory:
+            # Everything the bot needs about authors comes with their messages, so neither messages nor members are
+            # cached, and members are only requested from Discord when something asks for them
+            client_options.setdefault("max_messages", None)
+            client_options.setdefault("member_cache_flags", discord.MemberCacheFlags.none())
+            client_options.setdefault("chunk_guilds_at_startup", False)
+        super().__init__(intents=intents, **client_options)
+        instrument_http(self.http)
         self.token = token
-        self.config_manager = ConfigManager(self)
-        self.random_message = RandomMessage(self, self.config_manager)
-        self.pollgames = PollGames(self.random_message, self.config_manager)
-        self.commands = Commands(self, self.config_manager, self.random_message, self.pollgames)
+        self.worker_index = worker_index
+        self.startup_timings = {}
+        self.started_at = time.perf_counter()
+        self.ready_once = False
+        backend = self.CONFIG_BACKEND or os.environ.get("CONFIG_BACKEND", "json")
+        self.config_manager = ConfigManager(self, backend=backend)
+        self.end_phase("load_configs")
+        self.author_index = AuthorIndex()
+        if worker_index is None:
+            self.histograms = HistogramStore.next_to(self.config_manager.config_path)
+            self.message_archive = MessageArchive(self.histograms, self.author_index)
+        else:
+            # Workers archive their own guilds' channels, so none of them waits on another's writes
+            self.histograms = HistogramStore.next_to(self.config_manager.config_path,
+                                                     f"message_histograms.worker-{worker_index}.json")
+            self.message_archive = MessageArchive(self.histograms, self.author_index,
+                                                  f"message_archive.worker-{worker_index}.db")
+        self.channel_resolver = ChannelResolver(self)
+        self.random_message = RandomMessage(self, self.config_manager, self.message_archive, self.histograms,
+                                            self.channel_resolver, self.author_index)
+        self.countdown_scheduler = CountdownScheduler()
+        self.pollgames = PollGames(self.random_message, self.config_manager, self.countdown_scheduler,
+                                   self.author_index)
+        self.candidate_pool = CandidatePool(self.random_message, self.config_manager)
+        self.post_scheduler = PostScheduler(self, self.config_manager, self.candidate_pool, self.random_message)
+        self.commands = Commands(self, self.config_manager, self.random_message, self.pollgames, self.message_archive,
+                                 self.candidate_pool, self.post_scheduler)
         self.helper_funcs = HelperFuncs(self)
+        if self.low_memory:
+            self.apply_low_memory_bounds()
+        metrics_port = os.environ.get("METRICS_PORT")
+        self.metrics_server = MetricsServer(int(metrics_port) + (worker_index or 0)) if metrics_port else None
+        self.lag_monitor = None
+
+    def apply_low_memory_bounds(self) -> NoReturn:
+        """Shrinks the bounds of the bot's own caches, trading more history fetches for less memory."""
+        self.candidate_pool.MAX_SIZE = 8
+        self.candidate_pool.LOW_WATER_MARK = 2
+        self.candidate_pool.recently_sent.size = 100
+        self.channel_resolver.MAX_SIZE = 100
+        self.author_index.MAX_AUTHORS_PER_CHANNEL = 100
+
+    async def setup_hook(self) -> NoReturn:
+        """Starts monitoring the event loop and serving metrics before connecting to Discord."""
+        self.lag_monitor = asyncio.create_task(monitor_event_loop_lag())
+        if self.metrics_server is not None:
+            await self.metrics_server.start()
+        self.end_phase("setup")
 
     async def on_ready(self) -> NoReturn:
-        """Handles actions to be performed once the bot is ready and connected to Discord."""
-        logging.info(f"Ready: {self.user}")
-        # Load server configutarions and add new server configuaration to it if availabe
-        self.config_manager.load_configs()
-        self.config_manager.update_configs()
+        """Handles actions to be performed once the bot is ready and connected to Discord.
+
+        The configurations were loaded when the bot was created. After a reconnect, only the guilds joined or left
+        in the meantime are reconciled.
+        """
+        if self.ready_once:
+            logging.info("Ready again after reconnecting: %s", self.user)
+            self.forget_guilds(self.config_manager.reconcile_guilds())
+            return
+        self.ready_once = True
+        logging.info("Ready: %s", self.user)
+        self.end_phase("connect")
+        self.forget_guilds(self.config_manager.reconcile_guilds())
+        self.end_phase("reconcile_guilds")
+        self.resume_archiving()
+        self.end_phase("resume_archiving")
+        self.post_scheduler.load()
+        self.end_phase("load_schedules")
+        for phase, seconds in self.startup_timings.items():
+            STARTUP_PHASE_SECONDS.set(seconds, phase=phase)
+        logging.info("Started in %.2fs: %s", sum(self.startup_timings.values()),
+                     ", ".join(f"{phase} {seconds * 1000:.0f}ms" for phase, seconds in self.startup_timings.items()))
+
+    def end_phase(self, phase: str) -> NoReturn:
+        """Records how long a phase of the startup took, from the end of the previous phase until now."""
+        self.startup_timings[phase] = time.perf_counter() - self.started_at - sum(self.startup_timings.values())
+
+    def forget_guilds(self, removed_configs: dict[str, dict]) -> NoReturn:
+        """Drops the archived messages and candidates of the guilds the bot left."""
+        for guild_id, config in removed_configs.items():
+            if config.get(KEY_SELECT_FROM) is not None:
+                self.message_archive.forget_channel(int(config[KEY_SELECT_FROM]))
+            self.candidate_pool.invalidate(int(guild_id))
+
+    def resume_archiving(self) -> NoReturn:
+        """Archives the messages sent in the source channels since the bot last ran."""
+        for config in self.config_manager.server_configs.values():
+            if config[KEY_SELECT_FROM] is None:
+                continue
+            channel = self.get_channel(int(config[KEY_SELECT_FROM]))
+            if channel is not None:
+                self.message_archive.start_backfill(channel)
 
     async def on_guild_join(self, guild: discord.Guild) -> NoReturn:
         """Initialize guild's config upon joining, if it doesn't already exist"""
-        logging.info(f"Joinned a new guild: {guild.name} (ID: {guild.id})")
+        logging.info("Joinned a new guild: %s (ID: %s)", guild.name, guild.id, extra={"guild": guild.id})
         if str(guild.id) not in self.config_manager.server_configs:
             self.config_manager.initialize_guild_config(guild)
-            self.config_manager.save_configs_to_file()
-            logging.info(f"Default configuration initialized for guild: {guild.name} (ID: {guild.id})")
+            logging.info("Default configuration initialized for guild: %s (ID: %s)", guild.name, guild.id,
+                         extra={"guild": guild.id})
         else:
-            logging.info(f"Existing configuration found for guild: {guild.name} (ID: {guild.id}), no update necessary.")
+            logging.info("Existing configuration found for guild: %s (ID: %s), no update necessary.", guild.name, guild.id,
+                         extra={"guild": guild.id})
+
+    async def on_guild_remove(self, guild: discord.Guild) -> NoReturn:
+        """Removes the configuration and archived messages of a guild the bot left."""
+        logging.info("Left guild: %s (ID: %s)", guild.name, guild.id, extra={"guild": guild.id})
+        config = self.config_manager.remove_guild_config(guild.id)
+        if config is not None:
+            self.forget_guilds({str(guild.id): config})
 
     async def on_message(self, message: discord.Message) -> NoReturn:
         """Responds to new messages, excluding those sent by the bot itself. """
         if message.author == self.user:
             return
+        self.message_archive.add(message)
+        self.histograms.record(message.channel.id, message.created_at)
+        if message.channel.id in self.message_archive.tracked_channels or self.author_index.has_channel(message.channel.id):
+            self.author_index.record(message.channel.id, message.author.name, message.created_at)
         await self.commands.handle_command(message)
 
+    async def on_guild_channel_delete(self, channel: discord.abc.GuildChannel) -> NoReturn:
+        """Drops a deleted channel from the channel cache."""
+        self.channel_resolver.invalidate(channel.id)
+
+    async def on_guild_channel_update(self, before: discord.abc.GuildChannel, after: discord.abc.GuildChannel) -> NoReturn:
+        """Drops an updated channel from the channel cache so its new state is used."""
+        self.channel_resolver.invalidate(after.id)
+
+    async def on_raw_message_edit(self, payload: discord.RawMessageUpdateEvent) -> NoReturn:
+        """Keeps the archived copy of an edited message up to date and drops it from the candidate pool, so its old
+        content isn't posted."""
+        self.message_archive.update(payload)
+        self.candidate_pool.discard(payload.guild_id, {payload.message_id})
+
+    async def on_raw_message_delete(self, payload: discord.RawMessageDeleteEvent) -> NoReturn:
+        """Removes a deleted message from the archive."""
+        self.message_archive.delete({payload.message_id}, payload.channel_id)
+        self.candidate_pool.discard(payload.guild_id, {payload.message_id})
+
+    async def on_raw_bulk_message_delete(self, payload: discord.RawBulkMessageDeleteEvent) -> NoReturn:
+        """Removes bulk deleted messages from the archive."""
+        self.message_archive.delete(payload.message_ids, payload.channel_id)
+        self.candidate_pool.discard(payload.guild_id, payload.message_ids)
+
+    async def close(self) -> NoReturn:
+        """Shuts down the bot's components before disconnecting."""
+        await self.shutdown_components()
+        await super().close()
+
+    async def shutdown_components(self) -> NoReturn:
+        """Stops background work and saves everything that hasn't been saved yet."""
+        if self.lag_monitor is not None:
+            self.lag_monitor.cancel()
+        if self.metrics_server is not None:
+            self.metrics_server.close()
+        self.candidate_pool.close()
+        self.countdown_scheduler.shutdown()
+        self.post_scheduler.shutdown()
+        await self.config_manager.flush()
+        self.message_archive.close()
+        await self.histograms.flush()
+
     def run_bot(self) -> NoReturn:
         """Starts bot using the provided token"""
         self.run(self.token)
+
+
+class ShardedBot(Bot, discord.AutoShardedClient):
+    """The bot as an auto-sharded client, running some of the bot's shards in one of several worker processes.
+
+    Every worker shares the server configurations, so they are always stored in SQLite, which can safely be written
+    by several processes at once. Each worker only writes the configurations of the guilds on its own shards.
+    """
+    CONFIG_BACKEND = "sqlite"
@@ -0,0 +1,204 @@
+import discord
+import random
+import asyncio
+import logging
+from collections import deque
+from typing import Iterable, NoReturn, Optional
+from config_manager import ConfigManager
+from random_message import RandomMessage
+from message_archive import ArchivedMessage
+from constants import KEY_SELECT_FROM, KEY_GUILD_NAME
+from metrics import CACHE_LOOKUPS
+
+
+class RecentlySent:
+    """Remembers the IDs of the last messages sent in each guild, so they aren't sent again soon.
+
+    Each guild keeps at most `size` IDs in a ring buffer, mirrored in a set for constant-time lookups.
+    """
+    def __init__(self, size: int = 500) -> NoReturn:
+        self.size = size
+        self.buffers = {}
+        self.members = {}
+
+    def record(self, guild_id: int, message_ids: Iterable[int]) -> NoReturn:
+        buffer = self.buffers.setdefault(guild_id, deque())
+        members = self.members.setdefault(guild_id, set())
+        for message_id in message_ids:
+            if message_id in members:
+                continue
+            if len(buffer) >= self.size:
+                members.discard(buffer.popleft())
+            buffer.append(message_id)
+            members.add(message_id)
+
+    def contains(self, guild_id: int, message_id: int) -> bool:
+        return message_id in self.members.get(guild_id, ())
+
+
+class CandidatePool:
+    """Keeps a bounded pool of candidate messages per guild that already meet the guild's criteria, so a random
+    message can be sent without waiting for the channel's history to be fetched.
+
+    Candidates are found by the random message manager's retry policy. Messages that were sent recently are left out
+    unless a whole window consists of them. Pools are refilled in the background once they drop below the low-water
+    mark. Background fetches from all
+    guilds share a single throttle to stay well inside Discord's rate limits, while fetches made because a user
+    is waiting on an empty pool are not throttled.
+
+    Attributes:
+        random_message (RandomMessage): Fetches candidate messages from the source channels.
+        config_manager (ConfigManager): Provides the guilds' configurations.
+        pools (dict[int, deque[ArchivedMessage]]): The candidate messages, keyed by guild ID.
+        recently_sent (RecentlySent): The IDs of the messages each guild was sent last.
+    """
+    MAX_SIZE = 20
+    LOW_WATER_MARK = 5
+    CANDIDATES_PER_FETCH = 5
+    MAX_EMPTY_FETCHES = 3
+    MIN_FETCH_INTERVAL_SECONDS = 0.5
+
+    def __init__(self, random_message: RandomMessage, config_manager: ConfigManager) -> NoReturn:
+        self.random_message = random_message
+        self.config_manager = config_manager
+        self.pools = {}
+        self.recently_sent = RecentlySent()
+        self.generations = {}
+        self.refill_tasks = {}
+        self.throttle_lock = asyncio.Lock()
+        self.next_fetch_at = 0.0
+
+    async def take(self, guild_id: int, count: int = 1,
+                   keywords: frozenset[str] = frozenset()) -> list[ArchivedMessage]:
+        """Removes and returns up to `count` different candidate messages for the guild, fetching more directly if
+        the pool runs out, and remembers them as sent.
+
+        Candidates containing keywords aren't pooled, since they're rarely asked for twice; they're searched for
+        directly instead.
+        """
+        if keywords:
+            return await self.take_matching(guild_id, count, keywords)
+        pool = self.pools.setdefault(guild_id, deque(maxlen=self.MAX_SIZE))
+        CACHE_LOOKUPS.inc(cache="candidate_pool", result="hit" if len(pool) >= count else "miss")
+        candidates = []
+        taken_ids = set()
+        for _ in range(self.MAX_EMPTY_FETCHES + 1):
+            while pool and len(candidates) < count:
+                candidate = pool.popleft()
+                if candidate.id not in taken_ids:
+                    candidates.append(candidate)
+                    taken_ids.add(candidate.id)
+            if len(candidates) >= count:
+                break
+            generation = self.generations.get(guild_id, 0)
+            if await self.fetch(guild_id, generation, throttled=False, limit=count - len(candidates),
+                                excluded_ids=taken_ids) == 0:
+                break
+            pool = self.pools.setdefault(guild_id, deque(maxlen=self.MAX_SIZE))
+        self.recently_sent.record(guild_id, (candidate.id for candidate in candidates))
+        self.schedule_refill(guild_id)
+        return candidates
+
+    async def take_matching(self, guild_id: int, count: int, keywords: frozenset[str]) -> list[ArchivedMessage]:
+        """Returns up to `count` different messages containing every keyword, preferring those not sent recently."""
+        config = self.config_manager.load_guild_config(guild_id)
+        try:
+            messages = await self.random_message.find_candidates(guild_id, config, keywords)
+        except discord.Forbidden:
+            logging.error("Permissions error when searching the source channel of %s.", config[KEY_GUILD_NAME],
+                          extra={"guild": guild_id})
+            return []
+        except discord.HTTPException:
+            logging.error("Network error when searching the source channel of %s.", config[KEY_GUILD_NAME],
+                          extra={"guild": guild_id})
+            return []
+        random.shuffle(messages)
+        messages.sort(key=lambda message: self.recently_sent.contains(guild_id, message.id))
+        candidates = messages[:count]
+        self.recently_sent.record(guild_id, (candidate.id for candidate in candidates))
+        return candidates
+
+    def invalidate(self, guild_id: int) -> NoReturn:
+        """Discards the guild's candidates, including those being fetched, after its configuration changed, and gives
+        its source channel another chance if its circuit was open."""
+        self.random_message.circuit_breaker.reset(guild_id)
+        self.generations[guild_id] = self.generations.get(guild_id, 0) + 1
+        self.pools.pop(guild_id, None)
+        task = self.refill_tasks.pop(guild_id, None)
+        if task is not None:
+            task.cancel()
+
+    def discard(self, guild_id: Optional[int], message_ids: set[int]) -> NoReturn:
+        """Removes deleted messages from the guild's pool."""
+        pool = self.pools.get(guild_id)
+        if pool:
+            self.pools[guild_id] = deque((candidate for candidate in pool if candidate.id not in message_ids),
+                                         maxlen=self.MAX_SIZE)
+
+    def schedule_refill(self, guild_id: int) -> NoReturn:
+        """Starts refilling the guild's pool in the background if it's below the low-water mark."""
+        if len(self.pools.get(guild_id, ())) >= self.LOW_WATER_MARK:
+            return
+        task = self.refill_tasks.get(guild_id)
+        if task is None or task.done():
+            self.refill_tasks[guild_id] = asyncio.create_task(self.refill(guild_id))
+
+    async def refill(self, guild_id: int) -> NoReturn:
+        """Fills the guild's pool up to its maximum size, giving up after consecutive empty fetches."""
+        generation = self.generations.get(guild_id, 0)
+        empty_fetches = 0
+        while len(self.pools.get(guild_id, ())) < self.MAX_SIZE and empty_fetches < self.MAX_EMPTY_FETCHES:
+            if await self.fetch(guild_id, generation, throttled=True) == 0:
+                empty_fetches += 1
+            if generation != self.generations.get(guild_id, 0):
+                return
+
+    async def fetch(self, guild_id: int, generation: int, throttled: bool, limit: int = CANDIDATES_PER_FETCH,
+                    excluded_ids: Iterable[int] = ()) -> int:
+        """Finds candidate messages and adds up to `limit` random ones to the guild's pool, leaving out those that are
+        already pooled or in `excluded_ids`, e.g. because they were just taken.
+
+        Returns:
+            int: The number of candidates that were added.
+        """
+        config = self.config_manager.load_guild_config(guild_id)
+        if config[KEY_SELECT_FROM] is None:
+            return 0
+        if throttled:
+            await self.throttle()
+        try:
+            messages = await self.random_message.find_candidates(guild_id, config)
+        except discord.Forbidden:
+            logging.error("Permissions error when refilling the candidate pool of %s.", config[KEY_GUILD_NAME],
+                          extra={"guild": guild_id})
+            return 0
+        except discord.HTTPException:
+            logging.error("Network error when refilling the candidate pool of %s.", config[KEY_GUILD_NAME],
+                          extra={"guild": guild_id})
+            return 0
+        if generation != self.generations.get(guild_id, 0):
+            return 0
+
+        pool = self.pools.setdefault(guild_id, deque(maxlen=self.MAX_SIZE))
+        pooled_ids = {candidate.id for candidate in pool}.union(excluded_ids)
+        new_candidates = [message for message in messages if message.id not in pooled_ids]
+        unsent_candidates = [message for message in new_candidates
+                             if not self.recently_sent.contains(guild_id, message.id)]
+        new_candidates = unsent_candidates or new_candidates
+        random.shuffle(new_candidates)
+        new_candidates = new_candidates[:min(limit, self.MAX_SIZE - len(pool))]
+        pool.extend(new_candidates)
+        return len(new_candidates)
+
+    async def throttle(self) -> NoReturn:
+        """Waits until the next background fetch is allowed."""
+        async with self.throttle_lock:
+            now = asyncio.get_running_loop().time()
+            if self.next_fetch_at > now:
+                await asyncio.sleep(self.next_fetch_at - now)
+            self.next_fetch_at = max(now, self.next_fetch_at) + self.MIN_FETCH_INTERVAL_SECONDS
+
+    def close(self) -> NoReturn:
+        """Cancels all running refills."""
+        for task in self.refill_tasks.values():
+            task.cancel()
@@ -0,0 +1,68 @@
+import time
+import discord
+from collections import OrderedDict
+from typing import NoReturn
+from metrics import CACHE_LOOKUPS
+
+
+class ChannelResolver:
+    """Resolves channel IDs to channel objects without a REST call whenever possible.
+
+    The gateway cache is checked first. Channels that aren't in it are fetched once and kept in a bounded LRU cache
+    for a limited time.
+
+    Attributes:
+        bot (discord.Client): The bot instance whose gateway cache is checked first.
+        cache (OrderedDict[int, tuple]): The fetched channels and their expiry times, least recently used first.
+        gateway_hits (int): How many channels were found in the gateway cache.
+        cache_hits (int): How many channels were found in the LRU cache.
+        misses (int): How many channels had to be fetched.
+    """
+    TTL_SECONDS = 600
+    MAX_SIZE = 1000
+
+    def __init__(self, bot: discord.Client) -> NoReturn:
+        self.bot = bot
+        self.cache = OrderedDict()
+        self.gateway_hits = 0
+        self.cache_hits = 0
+        self.misses = 0
+
+    async def resolve(self, channel_id: int) -> discord.abc.GuildChannel:
+        """Returns the channel with the given ID.
+
+        Raises:
+            discord.Forbidden: If the bot does not have permissions to fetch the channel.
+            discord.HTTPException: If fetching the channel fails.
+        """
+        channel_id = int(channel_id)
+        channel = self.bot.get_channel(channel_id)
+        if channel is not None:
+            self.gateway_hits += 1
+            CACHE_LOOKUPS.inc(cache="channel", result="gateway")
+            return channel
+
+        entry = self.cache.get(channel_id)
+        if entry is not None and entry[1] > time.monotonic():
+            self.cache.move_to_end(channel_id)
+            self.cache_hits += 1
+            CACHE_LOOKUPS.inc(cache="channel", result="lru")
+            return entry[0]
+
+        self.misses += 1
+        CACHE_LOOKUPS.inc(cache="channel", result="miss")
+        channel = await self.bot.fetch_channel(channel_id)
+        self.cache[channel_id] = (channel, time.monotonic() + self.TTL_SECONDS)
+        self.cache.move_to_end(channel_id)
+        while len(self.cache) > self.MAX_SIZE:
+            self.cache.popitem(last=False)
+        return channel
+
+    def invalidate(self, channel_id: int) -> NoReturn:
+        """Drops the channel from the cache after it was deleted or updated."""
+        self.cache.pop(int(channel_id), None)
+
+    def stats(self) -> dict:
+        """Returns the hit and miss counters."""
+        return {"gateway_hits": self.gateway_hits, "cache_hits": self.cache_hits, "misses": self.misses,
+                "cached_channels": len(self.cache)}
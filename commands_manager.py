@@ -1,13 +1,24 @@
+import sys
+import time
+import asyncio
 import discord
 import logging
+import metrics
+from datetime import datetime
 from helper_funcs import HelperFuncs
 from discord.ext import commands
-from typing import NoReturn
+from typing import NoReturn, Optional
 from poll_games import PollGames
 from config_manager import ConfigManager
 from random_message import RandomMessage
+from message_archive import MessageArchive
+from candidate_pool import CandidatePool
+from post_scheduler import PostScheduler
+from keyword_index import tokenize
+from rate_limiter import CommandRateLimiter
 from constants import (KEY_GUILD_NAME, KEY_SELECT_FROM, KEY_SEND_TO, KEY_ENABLE_ATTACHMENTS, KEY_ENABLE_URLS,
-                       KEY_ENABLE_MENTIONS, KEY_START_DATE, HELP_MESSAGE)
+                       KEY_ENABLE_MENTIONS, KEY_START_DATE, KEY_SCHEDULE_HOURS, KEY_NEXT_POST_AT, HELP_MESSAGE, COMMAND_PREFIX,
+                       MAX_RANMSG_COUNT)
 
 
 class Commands(commands.Cog):
@@ -18,80 +29,228 @@ class Commands(commands.Cog):
            bot (discord.Client): The Discord client instance.
            config_manager (ConfigManager): The configuration manager instance to handle server configurations.
            random_message (RandomMessage): The random message handler instance to manage sending random messages.
+           message_archive (MessageArchive): The local archive of the source channels' history.
+           candidate_pool (CandidatePool): The prefetched candidate messages of every guild.
+           post_scheduler (PostScheduler): Posts random messages in the guilds that scheduled them.
+           rate_limiter (CommandRateLimiter): Limits how many commands each guild and user can run.
+           routes (dict[str, Callable]): The command handlers, keyed by command name.
        """
-    def __init__(self, bot: discord.Client, config_manager: ConfigManager, random_message: RandomMessage, pollgames: PollGames) -> NoReturn:
+    MAX_CONCURRENT_SENDS = 3
+
+    def __init__(self, bot: discord.Client, config_manager: ConfigManager, random_message: RandomMessage, pollgames: PollGames,
+                 message_archive: MessageArchive, candidate_pool: CandidatePool,
+                 post_scheduler: PostScheduler) -> NoReturn:
         """Initializes the Commands object with necessary instances. """
         self.bot = bot
         self.config_manager = config_manager
         self.random_message = random_message
         self.pollgames = pollgames
+        self.message_archive = message_archive
+        self.candidate_pool = candidate_pool
+        self.post_scheduler = post_scheduler
+        self.rate_limiter = CommandRateLimiter()
+        # COMMAND LIST
+        self.routes = {
+            "$help": self.help_command,
+            "$selectandsend": self.select_and_send_command,
+            "$urls": self.urls_command,
+            "$attachments": self.attachments_command,
+            "$mentions": self.mentions_command,
+            "$ranmsg": self.ranmsg_command,
+            "$whosentit": self.whosentit_command,
+            "$schedule": self.schedule_command,
+            "$stats": self.stats_command,
+        }
 
-    # COMMAND LIST
     async def handle_command(self, message: discord.Message) -> NoReturn:
-        """Determines the type of command received and executes the corresponding action."""
-        current_config = self.config_manager.server_configs[str(message.guild.id)]
-        if message.content == "$help":
-            await self.help_command(message)
-        elif message.content.startswith("$selectandsend"):
-            await self.select_and_send_command(message, current_config)
-        elif message.content == "$urls":
-            await self.urls_command(message, current_config)
-        elif message.content == "$attachments":
-            await self.attachments_command(message, current_config)
-        elif message.content == "$mentions":
-            await self.mentions_command(message, current_config)
-        elif message.content == "$ranmsg":
-            if current_config[KEY_SELECT_FROM] is None or current_config[KEY_SEND_TO] is None:
-                await message.channel.send("Set up the bot first with $selectandsend command(use $help for more info)")
-                return
-            await self.random_message_command(message.guild)
-        elif message.content.startswith("$whosentit"):
-            await self.pollgames.pollgame_who_sent_it(message)
+        """Determines the type of command received and executes the corresponding action.
+
+        Messages that aren't commands are rejected before any configuration is looked up.
+        """
+        content = message.content
+        if not content.startswith(COMMAND_PREFIX):
+            return
+        command = content.split(maxsplit=1)[0]
+        handler = self.routes.get(command)
+        if handler is None or message.guild is None:
+            return
+        current_config = self.config_manager.server_configs.get(str(message.guild.id))
+        if current_config is None:
+            return
+        if not self.rate_limiter.allow(message.guild.id, message.author.id):
+            logging.info("Rate limited %s in %s", message.author, message.guild.name,
+                         extra={"guild": message.guild.id, "command": command})
+            metrics.RATE_LIMITED_COMMANDS.inc()
+            return
+        start = time.perf_counter()
+        try:
+            await handler(message, current_config)
+        finally:
+            latency = time.perf_counter() - start
+            metrics.COMMAND_LATENCY.observe(latency, command=command)
+            logging.info("Handled %s in %s", command, message.guild.name,
+                         extra={"guild": message.guild.id, "command": command, "latency_ms": round(latency * 1000, 1)})
 
     # COMMAND IMPLEMENTATIONS
     @staticmethod
-    async def help_command(message: discord.Message) -> NoReturn:
+    async def help_command(message: discord.Message, config: dict) -> NoReturn:
         """Sends a help message listing all available commands and descriptions."""
         await message.channel.send(HELP_MESSAGE)
 
     async def select_and_send_command(self, message: discord.Message, config: dict) -> NoReturn:
         """Sets the target text channel for random messages and updates the configuration."""
         channel_mentions = message.channel_mentions
-        if not channel_mentions:
+        # Both channels are checked before anything changes, so a missing one leaves the configuration intact
+        if len(channel_mentions) < 2:
             await message.channel.send(f"There was an error in setting up the target channel")
             return
 
         config[KEY_START_DATE] = await HelperFuncs.get_first_message_datetime(channel_mentions[0])
+        if config[KEY_SELECT_FROM] is not None and config[KEY_SELECT_FROM] != str(channel_mentions[0].id):
+            self.message_archive.forget_channel(int(config[KEY_SELECT_FROM]))
         config[KEY_SELECT_FROM] = str(channel_mentions[0].id)
-        config[KEY_SEND_TO] = str(message.channel_mentions[1].id)
+        config[KEY_SEND_TO] = str(channel_mentions[1].id)
         await message.channel.send(f"Random messages will be selected from {channel_mentions[0]}"
                                        f" and send to {channel_mentions[1]}")
-        logging.info(f"Select from {channel_mentions[0]} and send to {channel_mentions[1]}"
-                         f" with startdate: {config[KEY_START_DATE]}"
-                         f"in {config[KEY_GUILD_NAME]}")
-        self.config_manager.save_configs_to_file()
+        logging.info("Select from %s and send to %s with startdate: %s in %s", channel_mentions[0], channel_mentions[1],
+                     config[KEY_START_DATE], config[KEY_GUILD_NAME], extra={"guild": message.guild.id})
+        self.config_manager.mark_dirty(message.guild.id)
+        self.candidate_pool.invalidate(message.guild.id)
+        self.message_archive.start_backfill(channel_mentions[0])
 
     async def urls_command(self, message: discord.Message, config: dict) -> NoReturn:
         """Toggles the inclusion of URLs in random message selections."""
         config[KEY_ENABLE_URLS] = not config[KEY_ENABLE_URLS]
         await message.channel.send(f"URLs set to {config[KEY_ENABLE_URLS]}")
-        logging.info(f"URLs were set to {config[KEY_ENABLE_URLS]} in {config[KEY_GUILD_NAME]}")
-        self.config_manager.save_configs_to_file()
+        logging.info("URLs were set to %s in %s", config[KEY_ENABLE_URLS], config[KEY_GUILD_NAME],
+                     extra={"guild": message.guild.id})
+        self.config_manager.mark_dirty(message.guild.id)
+        self.candidate_pool.invalidate(message.guild.id)
 
     async def attachments_command(self, message: discord.Message, config: dict) -> NoReturn:
         """Toggles the inclusion of attachments in random message selections."""
         config[KEY_ENABLE_ATTACHMENTS] = not config[KEY_ENABLE_ATTACHMENTS]
         await message.channel.send(f"Attachments set to {config[KEY_ENABLE_ATTACHMENTS]}")
-        logging.info(f"Attachments was set to: {config[KEY_ENABLE_ATTACHMENTS]} in {config[KEY_GUILD_NAME]}")
-        self.config_manager.save_configs_to_file()
+        logging.info("Attachments was set to: %s in %s", config[KEY_ENABLE_ATTACHMENTS], config[KEY_GUILD_NAME],
+                     extra={"guild": message.guild.id})
+        self.config_manager.mark_dirty(message.guild.id)
+        self.candidate_pool.invalidate(message.guild.id)
 
     async def mentions_command(self, message: discord.Message, config: dict) -> NoReturn:
         """Toggles the inclusion of attachments in random message selections."""
         config[KEY_ENABLE_MENTIONS] = not config[KEY_ENABLE_MENTIONS]
         await message.channel.send(f"Mentions set to {config[KEY_ENABLE_MENTIONS]}")
-        logging.info(f"Mentions was set to: {config[KEY_ENABLE_MENTIONS]} in {config[KEY_GUILD_NAME]}")
-        self.config_manager.save_configs_to_file()
+        logging.info("Mentions was set to: %s in %s", config[KEY_ENABLE_MENTIONS], config[KEY_GUILD_NAME],
+                     extra={"guild": message.guild.id})
+        self.config_manager.mark_dirty(message.guild.id)
+        self.candidate_pool.invalidate(message.guild.id)
+
+    async def ranmsg_command(self, message: discord.Message, config: dict) -> NoReturn:
+        """Sends one or more random messages if the source and destination channels have been set up."""
+        if config[KEY_SELECT_FROM] is None or config[KEY_SEND_TO] is None:
+            await message.channel.send("Set up the bot first with $selectandsend command(use $help for more info)")
+            return
+        arguments = self.get_count_and_keywords_from_message(message.content)
+        if arguments is None:
+            await message.channel.send(f"Please provide a number of messages between 1 and {MAX_RANMSG_COUNT} and/or "
+                                       f"keywords of at least 2 characters.")
+            return
+        count, keywords = arguments
+        await self.random_message_command(message.guild, count, keywords)
+
+    async def whosentit_command(self, message: discord.Message, config: dict) -> NoReturn:
+        """Starts a poll game about who sent a random message."""
+        await self.pollgames.pollgame_who_sent_it(message)
+
+    async def schedule_command(self, message: discord.Message, config: dict) -> NoReturn:
+        """Shows, sets or stops the guild's schedule of random messages."""
+        parts = message.content.split()
+        if len(parts) == 1:
+            if config.get(KEY_SCHEDULE_HOURS) is None:
+                await message.channel.send("No random messages are scheduled.")
+            else:
+                next_post_at = datetime.fromisoformat(config[KEY_NEXT_POST_AT])
+                await message.channel.send(f"A random message is sent every {config[KEY_SCHEDULE_HOURS]:g} hours, "
+                                           f"next at {next_post_at:%Y-%m-%d %H:%M} UTC.")
+            return
+        if len(parts) == 2 and parts[1].lower() == "off":
+            self.post_scheduler.set_schedule(message.guild.id, None)
+            await message.channel.send("Scheduled random messages were stopped.")
+            logging.info("Schedule was stopped in %s", config[KEY_GUILD_NAME], extra={"guild": message.guild.id})
+            return
+        if config[KEY_SELECT_FROM] is None or config[KEY_SEND_TO] is None:
+            await message.channel.send("Set up the bot first with $selectandsend command(use $help for more info)")
+            return
+        try:
+            hours = float(parts[1])
+        except ValueError:
+            hours = None
+        if len(parts) != 2 or hours is None or not PostScheduler.MIN_HOURS <= hours <= PostScheduler.MAX_HOURS:
+            await message.channel.send(f"Please provide a number of hours between {PostScheduler.MIN_HOURS} and "
+                                       f"{PostScheduler.MAX_HOURS}, or off.")
+            return
+        first_post_at = self.post_scheduler.set_schedule(message.guild.id, hours)
+        await message.channel.send(f"A random message will be sent every {hours:g} hours, starting at "
+                                   f"{first_post_at:%Y-%m-%d %H:%M} UTC.")
+        logging.info("Schedule was set to every %s hours in %s", hours, config[KEY_GUILD_NAME],
+                     extra={"guild": message.guild.id})
+
+    async def stats_command(self, message: discord.Message, config: dict) -> NoReturn:
+        """Sends a summary of the bot's metrics and of the server's memory use to server administrators."""
+        if not message.author.guild_permissions.administrator:
+            await message.channel.send("Only administrators can use $stats.")
+            return
+        await message.channel.send(metrics.stats_summary() + "\n" + self.memory_report(message.guild, config))
 
-    async def random_message_command(self, guild: discord.Guild) -> NoReturn:
-        """Triggers the sending of a random message from the configured channel."""
-        await self.random_message.send_random_message_around_random_date(guild.id)
+    def memory_report(self, guild: discord.Guild, config: dict) -> str:
+        """Summarizes what the bot keeps in memory and on disk for the guild."""
+        process_memory = metrics.process_memory_bytes()
+        lines = [f"**Memory** (process: {process_memory / 2 ** 20:.0f}MB" if process_memory is not None
+                 else "**Memory** (process: unknown"]
+        lines[0] += ", low-memory mode)" if getattr(self.bot, "low_memory", False) else ")"
+        pool = self.candidate_pool.pools.get(guild.id, ())
+        pool_bytes = sum(sys.getsizeof(candidate) + sys.getsizeof(candidate.content) for candidate in pool)
+        lines.append(f"Cached members: {len(guild.members)}/{guild.member_count}, pooled candidates: {len(pool)} "
+                     f"(~{pool_bytes / 1024:.1f}KB), recently sent IDs: "
+                     f"{len(self.candidate_pool.recently_sent.buffers.get(guild.id, ()))}")
+        if config[KEY_SELECT_FROM] is not None:
+            channel_id = int(config[KEY_SELECT_FROM])
+            authors = self.random_message.author_index.channels.get(channel_id)
+            histogram = self.random_message.histograms.histograms.get(channel_id)
+            lines.append(f"Indexed authors: {len(authors.scores) if authors else 0}, histogram days: "
+                         f"{len(histogram.counts) if histogram else 0}, archived messages on disk: "
+                         f"{self.message_archive.count_messages(channel_id)}")
+        return "\n".join(lines)
+
+    async def random_message_command(self, guild: discord.Guild, count: int = 1,
+                                     keywords: frozenset[str] = frozenset()) -> NoReturn:
+        """Sends `count` different random messages, containing every keyword if any are given, from the guild's
+        candidate pool to the configured channel, a few at a time."""
+        candidates = await self.candidate_pool.take(guild.id, count, keywords)
+        if not candidates:
+            logging.info("No candidate message could be found for %s.", guild.name, extra={"guild": guild.id})
+            return
+        config = self.config_manager.load_guild_config(guild.id)
+        semaphore = asyncio.Semaphore(self.MAX_CONCURRENT_SENDS)
+
+        async def send(candidate):
+            async with semaphore:
+                logging.debug("Random messages sent: '%s' from '%s' at '%s'", candidate.content, candidate.author_name,
+                              candidate.created_at, extra={"guild": guild.id})
+                await self.random_message.send_message(config[KEY_SEND_TO], candidate)
+        await asyncio.gather(*(send(candidate) for candidate in candidates))
+
+    @staticmethod
+    def get_count_and_keywords_from_message(content: str) -> Optional[tuple[int, frozenset[str]]]:
+        """Extracts the number of messages to send, which is 1 if none is given, and the keywords they must contain
+        from the message content."""
+        parts = content.split()[1:]
+        count = 1
+        if parts and parts[0].isdigit():
+            count = int(parts.pop(0))
+            if not 1 <= count <= MAX_RANMSG_COUNT:
+                return None
+        keywords = tokenize(" ".join(parts))
+        if parts and not keywords:
+            return None
+        return count, keywords
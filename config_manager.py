@@ -1,67 +1,190 @@
+import os
 import json
+import time
+import asyncio
 import discord
 import logging
-from typing import NoReturn
-from datetime import datetime
+from typing import NoReturn, Optional
+from config_store import JsonConfigStore, SqliteConfigStore
+from metrics import CONFIG_WRITE_LATENCY
 from constants import (KEY_GUILD_NAME, KEY_SELECT_FROM, KEY_SEND_TO, KEY_ENABLE_ATTACHMENTS, KEY_ENABLE_URLS,
-                       KEY_ENABLE_MENTIONS, KEY_START_DATE)
+                       KEY_ENABLE_MENTIONS, KEY_START_DATE, KEY_SCHEDULE_HOURS, KEY_NEXT_POST_AT)
 
 
 class ConfigManager:
     """Manages the configurations for different servers that the bot operates in.
 
+    Changes are not written immediately. Guilds whose configuration changed are marked dirty, and all changes made
+    within a short window are written together on an executor thread, so saving never blocks the event loop.
+
         Attributes:
             bot (discord.Client): The bot instance to interact with Discord.
             config_path (str): The file path for storing server configurations.
             server_configs (dict): A dictionary holding server-specific configurations.
+            store (JsonConfigStore | SqliteConfigStore): The backend the configurations are persisted with.
     """
-    def __init__(self, bot: discord.Client, config_path="server_configs.json") -> NoReturn:
+    FLUSH_DELAY_SECONDS = 2.0
+
+    def __init__(self, bot: discord.Client, config_path="server_configs.json", backend="json") -> NoReturn:
         """Initializes the configuration manager with the bot instance and configuration path. """
         self.bot = bot
         self.config_path = config_path
+        if backend == "sqlite":
+            self.store = SqliteConfigStore(os.path.splitext(config_path)[0] + ".db")
+            self.store.import_json(config_path)
+        else:
+            self.store = JsonConfigStore(config_path)
         self.server_configs = {}
+        self.dirty_guilds = set()
+        self.removed_guilds = set()
+        self.flush_handle = None
+        self.flush_lock = asyncio.Lock()
         self.load_configs()
 
-    def update_configs(self) -> NoReturn:
-        """Updates the server configurations with any new servers the bot has joined since it last run."""
-        for guild in self.bot.guilds:
-            self.initialize_guild_config(guild)
+    def reconcile_guilds(self) -> dict[str, dict]:
+        """Adds the configurations of the servers the bot joined and removes those of the servers it left since it
+        last run, in a single pass followed by a single write.
+
+        Only the configurations of guilds on this process's own shards are removed, since the other processes'
+        guilds share the same store.
+
+        Returns:
+            dict[str, dict]: The removed configurations, keyed by guild ID.
+        """
+        guilds = {str(guild.id): guild for guild in self.bot.guilds}
+        added = [guild_id for guild_id in guilds if guild_id not in self.server_configs]
+        for guild_id in added:
+            self.server_configs[guild_id] = self.default_config(guilds[guild_id])
+        removed = {guild_id: self.server_configs.pop(guild_id) for guild_id in list(self.server_configs)
+                   if guild_id not in guilds and self.owns_guild(int(guild_id))}
+        if added or removed:
+            logging.info("Added the configurations of %s servers and removed those of %s servers.", len(added),
+                         len(removed))
+            self.dirty_guilds.update(added)
+            self.dirty_guilds -= removed.keys()
+            self.removed_guilds.update(removed)
+            self.schedule_flush()
+        return removed
+
+    def owns_guild(self, guild_id: int) -> bool:
+        """Checks whether the guild is on one of the shards run by this process."""
+        shard_ids = getattr(self.bot, "shard_ids", None)
+        shard_count = getattr(self.bot, "shard_count", None)
+        if not shard_ids or not shard_count:
+            return True
+        return (guild_id >> 22) % shard_count in shard_ids
 
     def initialize_guild_config(self, guild: discord.Guild):
         """Initialize guild's config"""
         guild_id = str(guild.id)
         if guild_id not in self.server_configs:
-            self.server_configs[guild_id] = {
-                KEY_GUILD_NAME: guild.name,
-                KEY_SELECT_FROM: None,
-                KEY_SEND_TO: None,
-                KEY_ENABLE_ATTACHMENTS: False,
-                KEY_ENABLE_URLS: False,
-                KEY_ENABLE_MENTIONS: False,
-                KEY_START_DATE: None,
-            }
-            logging.info(f"{guild.name}({guild.id}) is being added to server_configs")
-            self.save_configs_to_file()
+            self.server_configs[guild_id] = self.default_config(guild)
+            logging.info("%s(%s) is being added to server_configs", guild.name, guild.id, extra={"guild": guild.id})
+            self.mark_dirty(guild.id)
+
+    def remove_guild_config(self, guild_id: int) -> Optional[dict]:
+        """Removes the configuration of a guild the bot left.
+
+        Returns:
+            Optional[dict]: The removed configuration, if there was one.
+        """
+        config = self.server_configs.pop(str(guild_id), None)
+        if config is not None:
+            self.dirty_guilds.discard(str(guild_id))
+            self.removed_guilds.add(str(guild_id))
+            self.schedule_flush()
+        return config
+
+    @staticmethod
+    def default_config(guild: discord.Guild) -> dict:
+        """Returns the configuration of a guild that hasn't been set up yet."""
+        return {
+            KEY_GUILD_NAME: guild.name,
+            KEY_SELECT_FROM: None,
+            KEY_SEND_TO: None,
+            KEY_ENABLE_ATTACHMENTS: False,
+            KEY_ENABLE_URLS: False,
+            KEY_ENABLE_MENTIONS: False,
+            KEY_START_DATE: None,
+            KEY_SCHEDULE_HOURS: None,
+            KEY_NEXT_POST_AT: None,
+        }
 
     def load_configs(self) -> NoReturn:
-        """Loads the server configurations from a JSON file."""
+        """Loads the server configurations, writing any unsaved changes first."""
+        if self.dirty_guilds or self.removed_guilds:
+            self.save_configs_to_file()
         try:
-            with open('server_configs.json', 'r') as file:
-                self.server_configs = json.load(file)
+            self.server_configs = self.store.load()
         except FileNotFoundError:
             logging.info("JSON file not found. server_configs was initialized to {}.")
         except json.JSONDecodeError:
             logging.info("JSON file is likely empty. server_configs was initialized to {}.")
 
+    def mark_dirty(self, guild_id: int) -> NoReturn:
+        """Marks the guild's configuration as changed and schedules a write of all pending changes."""
+        self.dirty_guilds.add(str(guild_id))
+        self.schedule_flush()
+
+    def schedule_flush(self) -> NoReturn:
+        """Writes the pending changes after a short delay, or right away if there is no running event loop."""
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            self.save_configs_to_file()
+            return
+        if self.flush_handle is None:
+            self.flush_handle = loop.call_later(self.FLUSH_DELAY_SECONDS, lambda: asyncio.create_task(self.flush()))
+
+    def take_pending_changes(self) -> tuple[dict, set[str], set[str]]:
+        """Returns a snapshot of the configurations to write along with the changed and removed guild IDs, and
+        clears them."""
+        changed, removed = self.dirty_guilds, self.removed_guilds
+        self.dirty_guilds, self.removed_guilds = set(), set()
+        guild_ids = self.server_configs.keys() if self.store.needs_full_snapshot else changed
+        snapshot = {guild_id: dict(self.server_configs[guild_id]) for guild_id in guild_ids
+                    if guild_id in self.server_configs}
+        return snapshot, changed, removed
+
+    def restore_pending_changes(self, changed: set[str], removed: set[str]) -> NoReturn:
+        """Marks changes that failed to be written as pending again."""
+        self.dirty_guilds |= changed
+        self.removed_guilds |= removed - self.dirty_guilds
+
+    async def flush(self) -> NoReturn:
+        """Writes all pending changes on an executor thread."""
+        if self.flush_handle is not None:
+            self.flush_handle.cancel()
+            self.flush_handle = None
+        async with self.flush_lock:
+            if not self.dirty_guilds and not self.removed_guilds:
+                return
+            snapshot, changed, removed = self.take_pending_changes()
+            try:
+                await asyncio.get_running_loop().run_in_executor(None, self.write, snapshot, changed, removed)
+            except (OSError, ValueError, TypeError) as e:
+                logging.error("Failed to save server configurations: %s", e)
+                self.restore_pending_changes(changed, removed)
+
     def save_configs_to_file(self) -> NoReturn:
-        """Saves the current server configurations to a JSON file."""
-        def custom_converter(obj):
-            if isinstance(obj, datetime):
-                return obj.isoformat()
-            raise TypeError(f"Object of type {obj.__class__.__name__} is not JSON serializable.")
+        """Synchronously writes all pending changes, e.g. when there is no event loop to write them from."""
+        if self.flush_handle is not None:
+            self.flush_handle.cancel()
+            self.flush_handle = None
+        if not self.dirty_guilds and not self.removed_guilds:
+            return
+        snapshot, changed, removed = self.take_pending_changes()
+        try:
+            self.write(snapshot, changed, removed)
+        except (OSError, ValueError, TypeError) as e:
+            logging.error("Failed to save server configurations: %s", e)
+            self.restore_pending_changes(changed, removed)
 
-        with open('server_configs.json', 'w') as file:
-            json.dump(self.server_configs, file, default=custom_converter)
+    def write(self, snapshot: dict, changed: set[str], removed: set[str]) -> NoReturn:
+        """Writes the changes with the store, recording how long it took."""
+        start = time.perf_counter()
+        self.store.write(snapshot, changed, removed)
+        CONFIG_WRITE_LATENCY.observe(time.perf_counter() - start, backend=type(self.store).__name__)
 
     def load_guild_config(self, guild_id: int) -> dict:
         """Loads the configuration for the specified guild."""
@@ -73,5 +196,8 @@ class ConfigManager:
             'channel_to_send_to': self.server_configs[str_guild_id][KEY_SEND_TO],
             'enable_attachments': self.server_configs[str_guild_id][KEY_ENABLE_ATTACHMENTS],
             'enable_urls': self.server_configs[str_guild_id][KEY_ENABLE_URLS],
-            'enable_mentions': self.server_configs[str_guild_id][KEY_ENABLE_MENTIONS]
+            'enable_mentions': self.server_configs[str_guild_id][KEY_ENABLE_MENTIONS],
+            # Configurations saved before schedules were added don't have them
+            'schedule_hours': self.server_configs[str_guild_id].get(KEY_SCHEDULE_HOURS),
+            'next_post_at': self.server_configs[str_guild_id].get(KEY_NEXT_POST_AT)
         }
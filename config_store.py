@@ -0,0 +1,123 @@
+import os
+import json
+import sqlite3
+import tempfile
+from datetime import datetime
+from typing import NoReturn
+
+
+def config_converter(obj):
+    """Converts the values of a configuration that JSON can't serialize."""
+    if isinstance(obj, datetime):
+        return obj.isoformat()
+    raise TypeError(f"Object of type {obj.__class__.__name__} is not JSON serializable.")
+
+
+def write_json_atomically(path: str, data, default=None) -> NoReturn:
+    """Writes the data to a temporary file next to `path` and renames it over `path`, so a crash in the middle of a
+    write leaves the previous content intact."""
+    directory = os.path.dirname(os.path.abspath(path))
+    file_descriptor, temp_path = tempfile.mkstemp(dir=directory, prefix=f".{os.path.basename(path)}.", suffix=".tmp")
+    try:
+        with os.fdopen(file_descriptor, 'w') as file:
+            json.dump(data, file, default=default)
+            file.flush()
+            os.fsync(file.fileno())
+        os.replace(temp_path, path)
+    except BaseException:
+        os.unlink(temp_path)
+        raise
+
+
+class JsonConfigStore:
+    """Stores every guild's configuration in a single JSON file.
+
+    The file is always rewritten as a whole, but the new content is written to a temporary file first and then
+    renamed over the old one, so a crash in the middle of a write can't corrupt it.
+
+    Attributes:
+        path (str): The file path for storing server configurations.
+        needs_full_snapshot (bool): Whether writes need the configurations of every guild, not only changed ones.
+    """
+    needs_full_snapshot = True
+
+    def __init__(self, path: str) -> NoReturn:
+        self.path = path
+
+    def load(self) -> dict:
+        """Loads every guild's configuration.
+
+        Raises:
+            FileNotFoundError: If the file doesn't exist yet.
+            json.JSONDecodeError: If the file is empty or not valid JSON.
+        """
+        with open(self.path, 'r') as file:
+            return json.load(file)
+
+    def write(self, configs: dict, changed: set[str], removed: set[str]) -> NoReturn:
+        """Atomically replaces the file with the given configurations."""
+        write_json_atomically(self.path, configs, default=config_converter)
+
+
+class SqliteConfigStore:
+    """Stores each guild's configuration as a row of a SQLite database, so a write only touches the guilds that
+    changed.
+
+    Attributes:
+        path (str): The file path of the SQLite database.
+        needs_full_snapshot (bool): Whether writes need the configurations of every guild, not only changed ones.
+    """
+    needs_full_snapshot = False
+
+    def __init__(self, path: str) -> NoReturn:
+        self.path = path
+        connection = self.connect()
+        try:
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.execute("CREATE TABLE IF NOT EXISTS guild_configs (guild_id TEXT PRIMARY KEY, config TEXT NOT NULL)")
+            connection.commit()
+        finally:
+            connection.close()
+
+    def connect(self) -> sqlite3.Connection:
+        """Opens a connection to the database, which must be used on the thread that opened it."""
+        return sqlite3.connect(self.path, timeout=30)
+
+    def import_json(self, json_path: str) -> NoReturn:
+        """Copies the configurations of a JSON store into the database if it is still empty, so switching backends
+        keeps every guild's configuration. Importing the same file more than once is harmless."""
+        connection = self.connect()
+        try:
+            if connection.execute("SELECT 1 FROM guild_configs LIMIT 1").fetchone() is not None:
+                return
+        finally:
+            connection.close()
+        try:
+            configs = JsonConfigStore(json_path).load()
+        except (FileNotFoundError, json.JSONDecodeError):
+            return
+        self.write(configs, set(configs), set())
+
+    def load(self) -> dict:
+        """Loads every guild's configuration."""
+        connection = self.connect()
+        try:
+            rows = connection.execute("SELECT guild_id, config FROM guild_configs").fetchall()
+        finally:
+            connection.close()
+        return {guild_id: json.loads(config) for guild_id, config in rows}
+
+    def write(self, configs: dict, changed: set[str], removed: set[str]) -> NoReturn:
+        """Upserts the changed guilds' configurations and deletes the removed ones in a single transaction."""
+        connection = self.connect()
+        try:
+            with connection:
+                connection.executemany(
+                    "INSERT INTO guild_configs (guild_id, config) VALUES (?, ?) "
+                    "ON CONFLICT(guild_id) DO UPDATE SET config = excluded.config",
+                    [(guild_id, json.dumps(configs[guild_id], default=config_converter))
+                     for guild_id in changed if guild_id in configs])
+                connection.executemany("DELETE FROM guild_configs WHERE guild_id = ?",
+                                       [(guild_id,) for guild_id in removed])
+        finally:
+            connection.close()
@@ -5,6 +5,11 @@ KEY_ENABLE_MENTIONS = "enable_mentions"
 KEY_START_DATE = "start_date"
 KEY_SEND_TO = "channel_to_send_to"
 KEY_SELECT_FROM = "channel_to_select_from"
+KEY_SCHEDULE_HOURS = "schedule_hours"
+KEY_NEXT_POST_AT = "next_post_at"
+
+COMMAND_PREFIX = "$"
+MAX_RANMSG_COUNT = 10
 
 HELP_MESSAGE = """
         ** Commands **
@@ -17,7 +22,11 @@ HELP_MESSAGE = """
         `$mentions` -  Toggles the inclusion of messages with mentions(True/False). False by default. When enabled, 
         @(everyone), @(rolementions) and @(member) mentions are all included.
         `$attachments` - Toggles the inclusion of messages with attachments(True/False). False by default.
-        `$ranmsg` - Sends a random message from configured #sourcechannel to the #destchannel.
+        `$ranmsg *count* *keywords*` - Sends a random message from configured #sourcechannel to the #destchannel, or
+        *count* different ones(up to 10). If keywords are given, only messages containing all of them are sent.
+        `$schedule *hours*` - Sends a random message every *hours* hours. Use `$schedule off` to stop and `$schedule`
+        to show the current schedule.
+        `$stats` - Shows command latency, Discord API usage, retry and cache statistics(administrators only).
 
         Use $selectandsend to define the source and destination channels for the random message feature to 
         function correctly❗
@@ -0,0 +1,137 @@
+import math
+import heapq
+import asyncio
+import logging
+import discord
+import itertools
+from collections import deque
+from typing import NoReturn
+from metrics import COUNTDOWN_EDITS, ACTIVE_COUNTDOWNS
+
+
+class Countdown:
+    """The state of one poll's countdown."""
+    __slots__ = ("message", "ends_at", "answer", "finished")
+
+    def __init__(self, message: discord.Message, ends_at: float, answer: str, finished: asyncio.Future) -> NoReturn:
+        self.message = message
+        self.ends_at = ends_at
+        self.answer = answer
+        self.finished = finished
+
+
+class CountdownScheduler:
+    """Updates the countdown messages of every active poll from a single task.
+
+    Countdowns are kept in a heap ordered by when they next need to be edited. They are edited every
+    `COARSE_INTERVAL_SECONDS` and only every second during the final `FINE_THRESHOLD_SECONDS`. Intermediate edits
+    are skipped once `MAX_EDITS_PER_MINUTE` edits have been made in the last minute, but the answer is always
+    revealed.
+
+    Attributes:
+        heap (list[tuple[float, int, Countdown]]): The countdowns, ordered by the loop time of their next edit.
+        edit_times (deque[float]): The loop times of the edits made in the last minute.
+    """
+    COARSE_INTERVAL_SECONDS = 10
+    FINE_THRESHOLD_SECONDS = 5
+    MAX_EDITS_PER_MINUTE = 120
+
+    def __init__(self) -> NoReturn:
+        self.heap = []
+        self.counter = itertools.count()
+        self.wakeup = asyncio.Event()
+        self.runner = None
+        self.edit_times = deque()
+        self.edit_tasks = set()
+
+    async def start(self, channel: discord.TextChannel, duration: int, answer: str) -> asyncio.Future:
+        """Sends the countdown message and schedules its updates.
+
+        Returns:
+            asyncio.Future: A future that is resolved once the answer has been revealed.
+        """
+        loop = asyncio.get_running_loop()
+        countdown_message = await channel.send(f"Countdown: {duration}")
+        countdown = Countdown(countdown_message, loop.time() + duration, answer, loop.create_future())
+        self.push(countdown, loop.time())
+        ACTIVE_COUNTDOWNS.set(len(self.heap))
+        if self.runner is None or self.runner.done():
+            self.runner = asyncio.create_task(self.run())
+        self.wakeup.set()
+        return countdown.finished
+
+    def push(self, countdown: Countdown, now: float) -> NoReturn:
+        """Schedules the countdown's next edit."""
+        heapq.heappush(self.heap, (self.next_edit_at(countdown, now), next(self.counter), countdown))
+
+    def next_edit_at(self, countdown: Countdown, now: float) -> float:
+        """Returns when the countdown should next be edited, at the next multiple of the current interval."""
+        remaining = countdown.ends_at - now
+        step = 1 if remaining <= self.FINE_THRESHOLD_SECONDS + 1e-6 else self.COARSE_INTERVAL_SECONDS
+        next_remaining = (math.ceil(remaining / step - 1e-6) - 1) * step
+        if step != 1:
+            next_remaining = max(next_remaining, self.FINE_THRESHOLD_SECONDS)
+        return countdown.ends_at - max(next_remaining, 0)
+
+    async def run(self) -> NoReturn:
+        """Edits the countdowns as they become due, until none are left."""
+        loop = asyncio.get_running_loop()
+        while self.heap:
+            delay = self.heap[0][0] - loop.time()
+            if delay > 0:
+                self.wakeup.clear()
+                try:
+                    await asyncio.wait_for(self.wakeup.wait(), delay)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+
+            _, _, countdown = heapq.heappop(self.heap)
+            now = loop.time()
+            remaining = round(countdown.ends_at - now)
+            if remaining <= 0:
+                self.edit(countdown, f"Answer: {countdown.answer}", final=True)
+                ACTIVE_COUNTDOWNS.set(len(self.heap))
+                continue
+            if self.has_edit_budget(now):
+                self.edit(countdown, f"Countdown: {remaining}", final=False)
+            else:
+                COUNTDOWN_EDITS.inc(kind="skipped")
+            self.push(countdown, now)
+
+    def has_edit_budget(self, now: float) -> bool:
+        """Checks whether an intermediate edit can be made without exceeding the per-minute edit budget."""
+        while self.edit_times and now - self.edit_times[0] >= 60:
+            self.edit_times.popleft()
+        return len(self.edit_times) < self.MAX_EDITS_PER_MINUTE
+
+    def edit(self, countdown: Countdown, content: str, final: bool) -> NoReturn:
+        """Edits the countdown message in the background, so a slow edit doesn't delay the other countdowns."""
+        self.edit_times.append(asyncio.get_running_loop().time())
+        COUNTDOWN_EDITS.inc(kind="answer" if final else "countdown")
+        task = asyncio.create_task(self.edit_message(countdown, content, final))
+        self.edit_tasks.add(task)
+        task.add_done_callback(self.edit_tasks.discard)
+
+    async def edit_message(self, countdown: Countdown, content: str, final: bool) -> NoReturn:
+        try:
+            await countdown.message.edit(content=content)
+        except discord.NotFound:
+            logging.info("Countdown message was deleted, cancelling its countdown.")
+            self.heap = [entry for entry in self.heap if entry[2] is not countdown]
+            heapq.heapify(self.heap)
+            final = True
+        except discord.HTTPException:
+            logging.error("Failed to edit countdown message.")
+        if final and not countdown.finished.done():
+            countdown.finished.set_result(None)
+
+    def shutdown(self) -> NoReturn:
+        """Cancels every countdown and pending edit."""
+        if self.runner is not None:
+            self.runner.cancel()
+        for task in self.edit_tasks:
+            task.cancel()
+        for _, _, countdown in self.heap:
+            countdown.finished.cancel()
+        self.heap = []
@@ -4,25 +4,17 @@ import random
 import re
 from datetime import timezone, timedelta, datetime
 from typing import Optional
-from constants import (KEY_START_DATE, KEY_ENABLE_URLS, KEY_ENABLE_MENTIONS, KEY_ENABLE_ATTACHMENTS)
+from message_histogram import MessageHistogram
+from constants import KEY_START_DATE
+
+
+URL_REGEX = re.compile(r"(?i)\b((?:https?://|www\d{0,3}[.]|[a-z0-9.\-]+[.][a-z]{2,4}/)(?:[^\s()<>]+|\(([^\s()<>]+|(\([^\s()<>]+\)))*\))+(?:\(([^\s()<>]+|(\([^\s()<>]+\)))*\)|[^\s`!()\[\]{};:'\".,<>?«»“”‘’]))")
 
 
 class HelperFuncs:
     def __init__(self, bot: discord.Client):
         self.bot = bot
 
-    @staticmethod
-    def meets_message_criteria(config: dict, message: discord.Message) -> bool:
-        """Checks whether the message meets the criteria for being sent."""
-        contains_url = HelperFuncs.search_for_url(message.content)
-
-        criteria_result = (config[KEY_ENABLE_URLS] or not contains_url)
-        criteria_result &= (message.author != message.guild.me)
-        criteria_result &= (config[KEY_ENABLE_ATTACHMENTS] or not message.attachments)
-        criteria_result &= (config[KEY_ENABLE_MENTIONS] or not HelperFuncs.message_has_mentions(message))
-
-        return criteria_result
-
     @staticmethod
     async def get_first_message_datetime(channel: discord.TextChannel) -> Optional[str]:
         """Fetches the datetime of the first message in the specified channel.
@@ -49,20 +41,26 @@ class HelperFuncs:
             return
 
     @staticmethod
-    def generate_random_date_time(config: dict) -> datetime:
-        """Generates a random datetime within the configured start and end dates."""
+    def generate_random_date_time(config: dict, histogram: Optional[MessageHistogram] = None) -> datetime:
+        """Generates a random datetime within the configured start and end dates.
+
+        When the source channel's message histogram is given, the datetime is weighted by how many messages were
+        sent around it instead of being uniform over time.
+        """
         start_date = datetime.fromisoformat(config[KEY_START_DATE])
         end_date = datetime.now().replace(tzinfo=timezone.utc)
-        random_seconds = random.randint(0, int((end_date - start_date).total_seconds()))
-        random_date_time = start_date + timedelta(seconds=random_seconds)
-        logging.info(f"Generated random date: {random_date_time}")
+        if histogram is not None:
+            random_date_time = histogram.sample(start_date, end_date)
+        else:
+            random_seconds = random.randint(0, int((end_date - start_date).total_seconds()))
+            random_date_time = start_date + timedelta(seconds=random_seconds)
+        logging.debug("Generated random date: %s", random_date_time)
         return random_date_time.replace(tzinfo=timezone.utc)
 
     @staticmethod
     def search_for_url(message: str) -> bool:
         """Checks if the message contains a URL."""
-        url_pattern = r"(?i)\b((?:https?://|www\d{0,3}[.]|[a-z0-9.\-]+[.][a-z]{2,4}/)(?:[^\s()<>]+|\(([^\s()<>]+|(\([^\s()<>]+\)))*\))+(?:\(([^\s()<>]+|(\([^\s()<>]+\)))*\)|[^\s`!()\[\]{};:'\".,<>?«»“”‘’]))"
-        return re.search(url_pattern, message) is not None
+        return URL_REGEX.search(message) is not None
 
     @staticmethod
     def message_has_mentions(message: discord.Message) -> bool:
@@ -0,0 +1,66 @@
+import re
+import sqlite3
+from typing import Iterable, NoReturn
+
+WORD_REGEX = re.compile(r"\w{2,}")
+MAX_WORD_LENGTH = 40
+
+
+def tokenize(text: str) -> frozenset[str]:
+    """Returns the distinct lowercase words of a text that messages are indexed and searched by."""
+    return frozenset(word for word in WORD_REGEX.findall(text.lower()) if len(word) <= MAX_WORD_LENGTH)
+
+
+class KeywordIndex:
+    """An inverted index from the words of archived messages to their IDs, stored next to them in the archive's
+    database.
+
+    Postings are the primary key of a table without rowids, ordered by channel, word and message ID, so every posting
+    is stored once and the messages of a channel containing a word are a contiguous range of the index. Writes are
+    left for the archive to commit along with the messages they belong to.
+
+    Attributes:
+        connection (sqlite3.Connection): The archive's database connection.
+    """
+    MAX_COUNT = 10000
+
+    def __init__(self, connection: sqlite3.Connection) -> NoReturn:
+        self.connection = connection
+        self.connection.execute("""
+            CREATE TABLE IF NOT EXISTS postings (
+                channel_id INTEGER NOT NULL,
+                word TEXT NOT NULL,
+                message_id INTEGER NOT NULL,
+                PRIMARY KEY (channel_id, word, message_id)
+            ) WITHOUT ROWID
+        """)
+
+    def add(self, messages: Iterable[tuple[int, int, str]]) -> NoReturn:
+        """Indexes the words of (message ID, channel ID, content) tuples."""
+        self.connection.executemany(
+            "INSERT OR IGNORE INTO postings (channel_id, word, message_id) VALUES (?, ?, ?)",
+            [(channel_id, word, message_id) for message_id, channel_id, content in messages
+             for word in tokenize(content)])
+
+    def remove(self, messages: Iterable[tuple[int, int, str]]) -> NoReturn:
+        """Removes the postings of (message ID, channel ID, content) tuples, given the content they were indexed
+        with."""
+        self.connection.executemany(
+            "DELETE FROM postings WHERE channel_id = ? AND word = ? AND message_id = ?",
+            [(channel_id, word, message_id) for message_id, channel_id, content in messages
+             for word in tokenize(content)])
+
+    def forget_channel(self, channel_id: int) -> NoReturn:
+        self.connection.execute("DELETE FROM postings WHERE channel_id = ?", (channel_id,))
+
+    def rarest_first(self, channel_id: int, words: Iterable[str]) -> list[str]:
+        """Orders the words by how many of the channel's messages contain them, so searches can start from the
+        shortest posting list. Counting stops at `MAX_COUNT`, so common words don't take long to count."""
+        words = list(words)
+        if len(words) < 2:
+            return words
+        counts = {word: self.connection.execute(
+                      "SELECT COUNT(*) FROM (SELECT 1 FROM postings WHERE channel_id = ? AND word = ? LIMIT ?)",
+                      (channel_id, word, self.MAX_COUNT)).fetchone()[0]
+                  for word in words}
+        return sorted(counts, key=counts.get)
@@ -0,0 +1,53 @@
+import json
+import queue
+import logging
+import logging.handlers
+from typing import Optional
+
+# Fields that can be attached to a record with `extra=` and are copied into its JSON line
+STRUCTURED_FIELDS = ("guild", "command", "latency_ms")
+
+
+class JsonFormatter(logging.Formatter):
+    """Formats each record as a single JSON line."""
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            "time": self.formatTime(record, "%Y-%m-%d %H:%M:%S"),
+            "level": record.levelname,
+            "module": record.module,
+            "function": record.funcName,
+            "message": record.getMessage(),
+        }
+        for field in STRUCTURED_FIELDS:
+            if hasattr(record, field):
+                entry[field] = getattr(record, field)
+        if record.exc_info:
+            entry["exception"] = self.formatException(record.exc_info)
+        return json.dumps(entry, default=str)
+
+
+def configure_logging(path: str = "logs.txt", level: int = logging.INFO, max_bytes: int = 10 * 1024 * 1024,
+                      backup_count: int = 5, rotate_when: Optional[str] = None) -> logging.handlers.QueueListener:
+    """Routes every log record through a queue to a rotating JSON lines file written by a background thread.
+
+    The event loop only puts records on the queue, so logging never blocks it on disk I/O. Records are rotated by
+    size, or by time if `rotate_when` is given (e.g. "midnight").
+
+    Returns:
+        logging.handlers.QueueListener: The running listener, which must be stopped on exit to flush the queue.
+    """
+    if rotate_when is None:
+        file_handler = logging.handlers.RotatingFileHandler(path, maxBytes=max_bytes, backupCount=backup_count,
+                                                            encoding="utf-8")
+    else:
+        file_handler = logging.handlers.TimedRotatingFileHandler(path, when=rotate_when, backupCount=backup_count,
+                                                                 encoding="utf-8")
+    file_handler.setFormatter(JsonFormatter())
+
+    log_queue = queue.SimpleQueue()
+    listener = logging.handlers.QueueListener(log_queue, file_handler, respect_handler_level=True)
+    root = logging.getLogger()
+    root.setLevel(level)
+    root.handlers = [logging.handlers.QueueHandler(log_queue)]
+    listener.start()
+    return listener
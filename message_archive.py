@@ -0,0 +1,389 @@
+import sqlite3
+import random
+import asyncio
+import logging
+import discord
+from datetime import datetime
+from typing import NoReturn, Optional
+from helper_funcs import HelperFuncs
+from message_histogram import HistogramStore, MessageHistogram
+from author_index import AuthorIndex
+from keyword_index import KeywordIndex
+from constants import KEY_SELECT_FROM, KEY_ENABLE_URLS, KEY_ENABLE_ATTACHMENTS, KEY_ENABLE_MENTIONS
+
+
+class ArchivedMessage:
+    """A compact copy of the fields the bot needs from a message to post it or quiz users on it."""
+    __slots__ = ("id", "channel_id", "author_id", "author_name", "content", "created_at", "attachment_url",
+                 "has_url", "has_mentions")
+
+    def __init__(self, message_id: int, channel_id: int, author_id: int, author_name: str, content: str,
+                 created_at: datetime, attachment_url: Optional[str], has_url: bool, has_mentions: bool) -> NoReturn:
+        self.id = message_id
+        self.channel_id = channel_id
+        self.author_id = author_id
+        self.author_name = author_name
+        self.content = content
+        self.created_at = created_at
+        self.attachment_url = attachment_url
+        self.has_url = has_url
+        self.has_mentions = has_mentions
+
+    @classmethod
+    def from_message(cls, message: discord.Message) -> "ArchivedMessage":
+        """Builds a record from a message received from Discord."""
+        return cls(message.id, message.channel.id, message.author.id, message.author.name, message.content,
+                   message.created_at, message.attachments[0].url if message.attachments else None,
+                   HelperFuncs.search_for_url(message.content), HelperFuncs.message_has_mentions(message))
+
+    @classmethod
+    def from_row(cls, row: tuple) -> "ArchivedMessage":
+        """Builds a record from a row of the messages table."""
+        message_id, channel_id, author_id, author_name, content, created_at, attachment_url, has_url, has_mentions = row
+        return cls(message_id, channel_id, author_id, author_name, content, datetime.fromisoformat(created_at),
+                   attachment_url, bool(has_url), bool(has_mentions))
+
+    def to_row(self) -> tuple:
+        """Returns the record as a row of the messages table."""
+        return (self.id, self.channel_id, self.author_id, self.author_name, self.content, self.created_at.isoformat(),
+                self.attachment_url, int(self.has_url), int(self.attachment_url is not None), int(self.has_mentions))
+
+
+class MessageArchive:
+    """Keeps an on-disk copy of every configured source channel so random messages can be picked locally.
+
+    A channel is backfilled once from its full history and is then kept current from message events. Until the
+    backfill of a channel has completed, callers are expected to fall back to fetching history from Discord.
+
+    The words of every archived message are kept in a keyword index, so messages containing given keywords can be
+    sampled without scanning the channel. Channels archived before the index existed are indexed after their next
+    backfill.
+
+    Attributes:
+        db_path (str): The file path of the SQLite database.
+        tracked_channels (set[int]): The IDs of the channels that are being archived.
+        backfilled_channels (set[int]): The IDs of the channels whose history has been fully archived.
+        indexed_channels (set[int]): The IDs of the channels whose archived messages are all in the keyword index.
+        keyword_index (KeywordIndex): The inverted index of the archived messages' words.
+        histograms (HistogramStore): The message histograms, which are updated with the exact counts of backfills.
+        author_index (AuthorIndex): The active authors of each channel, which are recorded during backfills.
+    """
+    BATCH_SIZE = 500
+    INDEX_BATCH_SIZE = 2000
+    MAX_CONCURRENT_BACKFILLS = 2
+    COLUMNS = ("message_id, channel_id, author_id, author_name, content, created_at, attachment_url, "
+               "has_url, has_mentions")
+
+    def __init__(self, histograms: HistogramStore, author_index: AuthorIndex,
+                 db_path: str = "message_archive.db") -> NoReturn:
+        self.histograms = histograms
+        self.author_index = author_index
+        self.db_path = db_path
+        self.connection = sqlite3.connect(db_path)
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self.connection.execute("PRAGMA synchronous=NORMAL")
+        self.connection.executescript("""
+            CREATE TABLE IF NOT EXISTS messages (
+                message_id INTEGER PRIMARY KEY,
+                channel_id INTEGER NOT NULL,
+                author_id INTEGER NOT NULL,
+                author_name TEXT NOT NULL,
+                content TEXT NOT NULL,
+                created_at TEXT NOT NULL,
+                attachment_url TEXT,
+                has_url INTEGER NOT NULL,
+                has_attachment INTEGER NOT NULL,
+                has_mentions INTEGER NOT NULL,
+                position INTEGER
+            );
+            CREATE INDEX IF NOT EXISTS idx_messages_criteria
+                ON messages (channel_id, has_url, has_attachment, has_mentions);
+            CREATE INDEX IF NOT EXISTS idx_messages_channel ON messages (channel_id, message_id);
+            CREATE TABLE IF NOT EXISTS channels (
+                channel_id INTEGER PRIMARY KEY,
+                backfilled INTEGER NOT NULL DEFAULT 0,
+                last_message_id INTEGER,
+                indexed INTEGER NOT NULL DEFAULT 0
+            );
+        """)
+        channel_columns = {row[1] for row in self.connection.execute("PRAGMA table_info(channels)")}
+        if "indexed" not in channel_columns:
+            self.connection.execute("ALTER TABLE channels ADD COLUMN indexed INTEGER NOT NULL DEFAULT 0")
+        message_columns = {row[1] for row in self.connection.execute("PRAGMA table_info(messages)")}
+        if "position" not in message_columns:
+            # Messages archived before positions existed are numbered in the order they were sent
+            self.connection.execute("ALTER TABLE messages ADD COLUMN position INTEGER")
+            self.connection.execute("""
+                UPDATE messages SET position = numbered.position
+                FROM (SELECT message_id, ROW_NUMBER() OVER (PARTITION BY channel_id ORDER BY message_id) AS position
+                      FROM messages) AS numbered
+                WHERE messages.message_id = numbered.message_id
+            """)
+        self.connection.execute("CREATE INDEX IF NOT EXISTS idx_messages_position ON messages (channel_id, position)")
+        self.keyword_index = KeywordIndex(self.connection)
+        self.connection.commit()
+        rows = self.connection.execute("SELECT channel_id, backfilled, indexed FROM channels").fetchall()
+        self.tracked_channels = {channel_id for channel_id, _, _ in rows}
+        self.backfilled_channels = {channel_id for channel_id, backfilled, _ in rows if backfilled}
+        self.indexed_channels = {channel_id for channel_id, _, indexed in rows if indexed}
+        self.backfill_tasks = {}
+        self.backfill_semaphore = asyncio.Semaphore(self.MAX_CONCURRENT_BACKFILLS)
+
+    def start_backfill(self, channel: discord.TextChannel) -> NoReturn:
+        """Starts archiving the channel's history in the background, unless it's already in progress."""
+        if self.is_backfilling(channel.id):
+            return
+        if channel.id not in self.tracked_channels:
+            # A new channel has no messages yet, so every message it will have is indexed as it's archived
+            self.connection.execute("INSERT OR IGNORE INTO channels (channel_id, indexed) VALUES (?, 1)", (channel.id,))
+            self.connection.commit()
+            self.tracked_channels.add(channel.id)
+            self.indexed_channels.add(channel.id)
+        # The cursor is read before the backfill waits for its turn, so messages that arrive in the meantime can't
+        # move it past the messages it still has to fetch
+        row = self.connection.execute("SELECT last_message_id FROM channels WHERE channel_id = ?",
+                                      (channel.id,)).fetchone()
+        self.backfill_tasks[channel.id] = asyncio.create_task(self.backfill(channel, row[0] if row else None))
+
+    def is_backfilling(self, channel_id: int) -> bool:
+        """Checks whether a backfill of the channel is waiting for its turn or running."""
+        task = self.backfill_tasks.get(channel_id)
+        return task is not None and not task.done()
+
+    async def backfill(self, channel: discord.TextChannel, last_message_id: Optional[int]) -> NoReturn:
+        """Archives every message sent in the channel after the last archived one, oldest first."""
+        async with self.backfill_semaphore:
+            after = discord.Object(id=last_message_id) if last_message_id else None
+            batch = []
+            bucket_counts = {}
+            try:
+                async for message in channel.history(limit=None, after=after, oldest_first=True):
+                    batch.append(ArchivedMessage.from_message(message))
+                    if message.author.id != channel.guild.me.id:
+                        self.author_index.record(channel.id, message.author.name, message.created_at)
+                    bucket = MessageHistogram.bucket_of(message.created_at)
+                    bucket_counts[bucket] = bucket_counts.get(bucket, 0) + 1
+                    if len(batch) >= self.BATCH_SIZE:
+                        self.store_backfill_batch(channel.id, batch)
+                        self.histograms.merge_counts(channel.id, bucket_counts)
+                        batch = []
+                self.store_backfill_batch(channel.id, batch)
+                self.histograms.merge_counts(channel.id, bucket_counts)
+            except discord.Forbidden:
+                logging.error("Permissions error when archiving the history of #%s.", channel.name,
+                              extra={"guild": channel.guild.id})
+                return
+            except discord.HTTPException:
+                logging.error("Network error when archiving the history of #%s, progress was saved.", channel.name,
+                              extra={"guild": channel.guild.id})
+                return
+
+            if channel.id in self.tracked_channels:
+                self.connection.execute("UPDATE channels SET backfilled = 1 WHERE channel_id = ?", (channel.id,))
+                self.connection.commit()
+                self.backfilled_channels.add(channel.id)
+            await self.histograms.flush()
+            logging.info("Finished archiving the history of #%s in %s", channel.name, channel.guild.name,
+                         extra={"guild": channel.guild.id})
+            if channel.id in self.tracked_channels and channel.id not in self.indexed_channels:
+                await self.index_archived(channel.id)
+
+    async def index_archived(self, channel_id: int) -> NoReturn:
+        """Adds the channel's messages that were archived before the keyword index existed to it, a batch at a
+        time."""
+        after = 0
+        while channel_id in self.tracked_channels:
+            rows = self.connection.execute("SELECT message_id, channel_id, content FROM messages WHERE channel_id = ? "
+                                           "AND message_id > ? ORDER BY message_id LIMIT ?",
+                                           (channel_id, after, self.INDEX_BATCH_SIZE)).fetchall()
+            if not rows:
+                self.connection.execute("UPDATE channels SET indexed = 1 WHERE channel_id = ?", (channel_id,))
+                self.connection.commit()
+                self.indexed_channels.add(channel_id)
+                logging.info("Finished indexing the archived messages of channel %s", channel_id)
+                return
+            self.keyword_index.add(rows)
+            self.connection.commit()
+            after = rows[-1][0]
+            await asyncio.sleep(0)
+
+    def store_backfill_batch(self, channel_id: int, batch: list[ArchivedMessage]) -> NoReturn:
+        """Stores a batch of backfilled messages and moves the channel's backfill cursor past them."""
+        if not batch or channel_id not in self.tracked_channels:
+            return
+        self.insert_messages(batch)
+        self.connection.execute("UPDATE channels SET last_message_id = ? WHERE channel_id = ?",
+                                (batch[-1].id, channel_id))
+        self.connection.commit()
+
+    def insert_messages(self, messages: list[ArchivedMessage]) -> NoReturn:
+        """Inserts or replaces the messages without committing, numbering them after the last archived message of
+        their channel."""
+        next_positions = {}
+        rows = []
+        for message in messages:
+            position = next_positions.get(message.channel_id)
+            if position is None:
+                position = self.connection.execute("SELECT IFNULL(MAX(position), 0) + 1 FROM messages "
+                                                   "WHERE channel_id = ?", (message.channel_id,)).fetchone()[0]
+            next_positions[message.channel_id] = position + 1
+            rows.append(message.to_row() + (position,))
+        self.connection.executemany(
+            "INSERT OR REPLACE INTO messages (message_id, channel_id, author_id, author_name, content, created_at, "
+            "attachment_url, has_url, has_attachment, has_mentions, position) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+            rows)
+        self.keyword_index.add((message.id, message.channel_id, message.content) for message in messages)
+
+    def forget_channel(self, channel_id: int) -> NoReturn:
+        """Stops archiving the channel and deletes its archived messages."""
+        task = self.backfill_tasks.pop(channel_id, None)
+        if task is not None:
+            task.cancel()
+        self.tracked_channels.discard(channel_id)
+        self.backfilled_channels.discard(channel_id)
+        self.indexed_channels.discard(channel_id)
+        self.keyword_index.forget_channel(channel_id)
+        self.connection.execute("DELETE FROM messages WHERE channel_id = ?", (channel_id,))
+        self.connection.execute("DELETE FROM channels WHERE channel_id = ?", (channel_id,))
+        self.connection.commit()
+
+    # EVENT HANDLERS
+    def add(self, message: discord.Message) -> NoReturn:
+        """Archives a newly sent message if its channel is being archived.
+
+        Once the channel's history is fully archived, the backfill cursor is moved past the message, so the next
+        backfill doesn't fetch it again. It isn't moved while a backfill is pending, since messages sent while the
+        bot was offline may still have to be fetched.
+        """
+        if message.channel.id not in self.tracked_channels:
+            return
+        self.insert_messages([ArchivedMessage.from_message(message)])
+        if message.channel.id in self.backfilled_channels and not self.is_backfilling(message.channel.id):
+            self.connection.execute("UPDATE channels SET last_message_id = MAX(IFNULL(last_message_id, 0), ?) "
+                                    "WHERE channel_id = ?", (message.id, message.channel.id))
+        self.connection.commit()
+
+    def update(self, payload: discord.RawMessageUpdateEvent) -> NoReturn:
+        """Updates an archived message after it has been edited."""
+        if payload.channel_id not in self.tracked_channels or "content" not in payload.data:
+            return
+        data = payload.data
+        attachments = data.get("attachments", [])
+        old_rows = self.connection.execute("SELECT message_id, channel_id, content FROM messages WHERE message_id = ?",
+                                           (payload.message_id,)).fetchall()
+        if old_rows:
+            self.keyword_index.remove(old_rows)
+            self.keyword_index.add([(payload.message_id, old_rows[0][1], data["content"])])
+        self.connection.execute(
+            "UPDATE messages SET content = ?, attachment_url = ?, has_url = ?, has_attachment = ?, has_mentions = ? "
+            "WHERE message_id = ?",
+            (data["content"], attachments[0]["url"] if attachments else None,
+             int(HelperFuncs.search_for_url(data["content"])), int(bool(attachments)),
+             int(bool(data.get("mentions") or data.get("mention_roles") or data.get("mention_everyone"))),
+             payload.message_id))
+        self.connection.commit()
+
+    def delete(self, message_ids: set[int], channel_id: int) -> NoReturn:
+        """Removes deleted messages from the archive."""
+        if channel_id not in self.tracked_channels:
+            return
+        placeholders = ", ".join("?" * len(message_ids))
+        self.keyword_index.remove(self.connection.execute(
+            f"SELECT message_id, channel_id, content FROM messages WHERE message_id IN ({placeholders})",
+            tuple(message_ids)).fetchall())
+        self.connection.executemany("DELETE FROM messages WHERE message_id = ?",
+                                    [(message_id,) for message_id in message_ids])
+        self.connection.commit()
+
+    # SELECTION
+    def sample(self, config: dict, excluded_author_id: int, keywords: frozenset[str] = frozenset(),
+               limit: int = 100) -> Optional[list[ArchivedMessage]]:
+        """Returns a random window of (up to) `limit` archived messages that meet the guild's criteria and contain
+        every keyword.
+
+        The window starts at a message of the channel drawn uniformly by its position, so busy periods are drawn in
+        proportion to their messages rather than to how long they lasted. Positions of deleted messages are left
+        unused, which makes the message after them slightly more likely to be drawn. The window is then read by
+        seeking from that message into an index: the channel's index of messages without keywords, or the postings
+        of the rarest keyword with them. Every step is an index lookup, so drawing a window takes the same time in
+        any channel.
+
+        Returns:
+            list[ArchivedMessage]: The selected messages, or None if the channel's history isn't fully archived (and
+            indexed, if keywords are given) yet.
+        """
+        channel_id = int(config[KEY_SELECT_FROM])
+        if channel_id not in self.backfilled_channels or (keywords and channel_id not in self.indexed_channels):
+            return None
+
+        criteria = ""
+        if not config[KEY_ENABLE_URLS]:
+            criteria += " AND has_url = 0"
+        if not config[KEY_ENABLE_ATTACHMENTS]:
+            criteria += " AND has_attachment = 0"
+        if not config[KEY_ENABLE_MENTIONS]:
+            criteria += " AND has_mentions = 0"
+        if keywords:
+            words = self.keyword_index.rarest_first(channel_id, keywords)
+            # CROSS JOIN keeps SQLite from reordering the join, so the rarest word's postings drive the query
+            source = "postings CROSS JOIN messages USING (message_id)"
+            conditions = "postings.channel_id = ? AND postings.word = ? AND author_id != ?" + criteria
+            conditions += (" AND EXISTS (SELECT 1 FROM postings AS other WHERE other.channel_id = postings.channel_id "
+                           "AND other.word = ? AND other.message_id = postings.message_id)") * (len(words) - 1)
+            parameters = (channel_id, words[0], excluded_author_id, *words[1:])
+            columns = "messages." + self.COLUMNS.replace(", ", ", messages.")
+            id_column = "postings.message_id"
+        else:
+            source = "messages"
+            conditions = "channel_id = ? AND author_id != ?" + criteria
+            parameters = (channel_id, excluded_author_id)
+            columns = self.COLUMNS
+            id_column = "message_id"
+        start_id = self.random_message_id(channel_id)
+        if start_id is None:
+            return []
+        return self.read_window(columns, source, conditions, parameters, id_column, start_id, limit)
+
+    def random_message_id(self, channel_id: int) -> Optional[int]:
+        """Returns the ID of a message of the channel drawn uniformly by position, or None if it has no messages."""
+        first_position = self.connection.execute("SELECT MIN(position) FROM messages WHERE channel_id = ?",
+                                                 (channel_id,)).fetchone()[0]
+        if first_position is None:
+            return None
+        last_position = self.connection.execute("SELECT MAX(position) FROM messages WHERE channel_id = ?",
+                                                (channel_id,)).fetchone()[0]
+        return self.connection.execute("SELECT message_id FROM messages WHERE channel_id = ? AND position >= ? "
+                                       "ORDER BY position LIMIT 1",
+                                       (channel_id, random.randint(first_position, last_position))).fetchone()[0]
+
+    def read_window(self, columns: str, source: str, conditions: str, parameters: tuple, id_column: str,
+                    start_id: int, limit: int) -> list[ArchivedMessage]:
+        """Reads the (up to) `limit` matching messages from `start_id` on, in the order of `id_column`, completing
+        the window with the messages right before it if it reaches the end of the channel."""
+        rows = self.connection.execute(f"SELECT {columns} FROM {source} WHERE {conditions} AND {id_column} >= ? "
+                                       f"ORDER BY {id_column} LIMIT ?", parameters + (start_id, limit)).fetchall()
+        if len(rows) < limit:
+            earlier_rows = self.connection.execute(
+                f"SELECT {columns} FROM {source} WHERE {conditions} AND {id_column} < ? ORDER BY {id_column} DESC "
+                f"LIMIT ?", parameters + (start_id, limit - len(rows))).fetchall()
+            rows = earlier_rows[::-1] + rows
+        return [ArchivedMessage.from_row(row) for row in rows]
+
+    def count_messages(self, channel_id: int) -> int:
+        """Returns how many of the channel's messages are archived."""
+        return self.connection.execute("SELECT COUNT(*) FROM messages WHERE channel_id = ?", (channel_id,)).fetchone()[0]
+
+    def recent_authors(self, channel_id: int, excluded_author_id: int,
+                       limit: int = 5000) -> list[tuple[str, datetime]]:
+        """Returns the author and creation time of the channel's most recent archived messages, except those of the
+        excluded author."""
+        rows = self.connection.execute("SELECT author_name, created_at FROM messages WHERE channel_id = ? "
+                                       "AND author_id != ? ORDER BY message_id DESC LIMIT ?",
+                                       (channel_id, excluded_author_id, limit)).fetchall()
+        return [(author_name, datetime.fromisoformat(created_at)) for author_name, created_at in rows]
+
+    def close(self) -> NoReturn:
+        """Cancels running backfills and closes the database."""
+        for task in self.backfill_tasks.values():
+            task.cancel()
+        self.connection.close()
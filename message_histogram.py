@@ -0,0 +1,233 @@
+import os
+import json
+import time
+import random
+import asyncio
+import logging
+from datetime import datetime, timezone, timedelta
+from typing import NoReturn, Optional
+from config_store import write_json_atomically
+
+
+class MessageHistogram:
+    """Estimates how many messages were sent in a channel per time bucket, so random dates can be drawn in
+    proportion to how many messages were sent around them instead of uniformly over time.
+
+    Attributes:
+        counts (dict[int, int]): The estimated message count of each observed bucket, keyed by bucket index.
+        fetched (int): The number of messages fetched from the channel's history so far.
+        accepted (int): How many of the fetched messages met the guild's criteria.
+    """
+    BUCKET_SECONDS = 86400
+    MIN_EDGE_COVERAGE_SECONDS = 3600
+    UNKNOWN_WINDOW_HIT_RATE = 0.5
+
+    def __init__(self, counts: Optional[dict[int, int]] = None, fetched: int = 0, accepted: int = 0) -> NoReturn:
+        self.counts = counts or {}
+        self.fetched = fetched
+        self.accepted = accepted
+
+    @classmethod
+    def bucket_of(cls, date: datetime) -> int:
+        """Returns the index of the bucket that the datetime falls in."""
+        return int(date.timestamp()) // cls.BUCKET_SECONDS
+
+    def observe(self, dates: list[datetime], accepted: int) -> NoReturn:
+        """Updates the estimates with a contiguous window of fetched message history.
+
+        Buckets that lie entirely inside the window are known exactly. Buckets at the edges of the window are
+        only partially covered, so their counts are extrapolated from the covered part.
+        """
+        self.fetched += len(dates)
+        self.accepted += accepted
+        if len(dates) < 2:
+            return
+
+        first, last = min(dates).timestamp(), max(dates).timestamp()
+        observed = {}
+        for date in dates:
+            bucket = self.bucket_of(date)
+            observed[bucket] = observed.get(bucket, 0) + 1
+
+        first_bucket, last_bucket = int(first) // self.BUCKET_SECONDS, int(last) // self.BUCKET_SECONDS
+        for bucket in range(first_bucket, last_bucket + 1):
+            count = observed.get(bucket, 0)
+            if first_bucket < bucket < last_bucket:
+                self.counts[bucket] = count
+                continue
+            bucket_start = bucket * self.BUCKET_SECONDS
+            covered = min(last, bucket_start + self.BUCKET_SECONDS) - max(first, bucket_start)
+            if covered < self.MIN_EDGE_COVERAGE_SECONDS:
+                continue
+            estimate = round(count * self.BUCKET_SECONDS / covered)
+            previous = self.counts.get(bucket)
+            self.counts[bucket] = estimate if previous is None else (previous + estimate) // 2
+
+    def merge_counts(self, counts: dict[int, int]) -> NoReturn:
+        """Raises the estimates to the exact counts of a sequential sweep over the history."""
+        for bucket, count in counts.items():
+            self.counts[bucket] = max(self.counts.get(bucket, 0), count)
+
+    def increment(self, date: datetime) -> NoReturn:
+        """Counts a newly sent message if its bucket has already been estimated."""
+        bucket = self.bucket_of(date)
+        if bucket in self.counts:
+            self.counts[bucket] += 1
+
+    def weights(self, first_bucket: int, last_bucket: int) -> list[float]:
+        """Returns the sampling weight of every bucket in the range.
+
+        Buckets that have never been observed are weighted by the average of the observed non-empty buckets, so
+        they are still explored.
+        """
+        non_empty = [count for count in self.counts.values() if count > 0]
+        prior = sum(non_empty) / len(non_empty) if non_empty else 1.0
+        return [self.counts.get(bucket, prior) for bucket in range(first_bucket, last_bucket + 1)]
+
+    def sample(self, start_date: datetime, end_date: datetime) -> datetime:
+        """Draws a random datetime between the dates, weighted by the estimated message counts."""
+        first_bucket, last_bucket = self.bucket_of(start_date), self.bucket_of(end_date)
+        weights = self.weights(first_bucket, last_bucket)
+        if sum(weights) <= 0:
+            bucket = random.randint(first_bucket, last_bucket)
+        else:
+            bucket = random.choices(range(first_bucket, last_bucket + 1), weights=weights)[0]
+
+        bucket_start = datetime.fromtimestamp(bucket * self.BUCKET_SECONDS, tz=timezone.utc)
+        date = bucket_start + timedelta(seconds=random.uniform(0, self.BUCKET_SECONDS))
+        return min(max(date, start_date), end_date)
+
+    def expected_api_calls(self, start_date: datetime, end_date: datetime, window_size: int = 100) -> float:
+        """Returns the expected number of history calls needed to draw a message that meets the guild's criteria.
+
+        A window drawn from an observed non-empty bucket yields a message unless none of its messages meet the
+        criteria, while a window drawn from an unobserved bucket is assumed to be a hit half of the time.
+        """
+        acceptance_rate = self.accepted / self.fetched if self.fetched else 1.0
+        criteria_hit_rate = 1 - (1 - acceptance_rate) ** window_size
+
+        first_bucket, last_bucket = self.bucket_of(start_date), self.bucket_of(end_date)
+        weights = self.weights(first_bucket, last_bucket)
+        total = sum(weights)
+        if total <= 0 or criteria_hit_rate <= 0:
+            return float("inf")
+        unknown = sum(weight for bucket, weight in zip(range(first_bucket, last_bucket + 1), weights)
+                      if bucket not in self.counts)
+        hit_rate = ((total - unknown) + self.UNKNOWN_WINDOW_HIT_RATE * unknown) / total * criteria_hit_rate
+        return 1 / hit_rate
+
+    def to_dict(self) -> dict:
+        return {"counts": {str(bucket): count for bucket, count in self.counts.items()},
+                "fetched": self.fetched, "accepted": self.accepted}
+
+    @classmethod
+    def from_dict(cls, data: dict) -> "MessageHistogram":
+        return cls({int(bucket): count for bucket, count in data["counts"].items()}, data["fetched"], data["accepted"])
+
+
+class HistogramStore:
+    """Holds the message histograms of every source channel and persists them next to the server configurations.
+
+    Histograms are saved at most every `SAVE_INTERVAL_SECONDS` on an executor thread, and the file is replaced
+    atomically, so saving neither blocks the event loop nor loses the histograms if the bot crashes mid-write.
+
+    Attributes:
+        path (str): The file path for storing the histograms.
+        histograms (dict[int, MessageHistogram]): The histograms, keyed by channel ID.
+    """
+    SAVE_INTERVAL_SECONDS = 60
+
+    def __init__(self, path: str = "message_histograms.json") -> NoReturn:
+        self.path = path
+        self.histograms = {}
+        self.dirty = False
+        self.last_save = time.monotonic()
+        self.save_lock = asyncio.Lock()
+        self.save_task = None
+        self.load()
+
+    @classmethod
+    def next_to(cls, config_path: str, name: str = "message_histograms.json") -> "HistogramStore":
+        """Creates a store whose file is in the same directory as the server configurations."""
+        return cls(os.path.join(os.path.dirname(config_path), name))
+
+    def get(self, channel_id: int) -> MessageHistogram:
+        """Returns the channel's histogram, creating an empty one if necessary."""
+        channel_id = int(channel_id)
+        if channel_id not in self.histograms:
+            self.histograms[channel_id] = MessageHistogram()
+        return self.histograms[channel_id]
+
+    def observe(self, channel_id: int, dates: list[datetime], accepted: int) -> NoReturn:
+        """Updates the channel's histogram with a window of fetched history."""
+        self.get(channel_id).observe(dates, accepted)
+        self.mark_dirty()
+
+    def merge_counts(self, channel_id: int, counts: dict[int, int]) -> NoReturn:
+        """Updates the channel's histogram with the counts of a sequential sweep over its history."""
+        self.get(channel_id).merge_counts(counts)
+        self.mark_dirty()
+
+    def record(self, channel_id: int, date: datetime) -> NoReturn:
+        """Counts a newly sent message in the channel's histogram, if it has one."""
+        histogram = self.histograms.get(channel_id)
+        if histogram is not None:
+            histogram.increment(date)
+            self.dirty = True
+
+    def mark_dirty(self) -> NoReturn:
+        """Marks the histograms as changed and saves them if they haven't been saved recently."""
+        self.dirty = True
+        if time.monotonic() - self.last_save >= self.SAVE_INTERVAL_SECONDS:
+            self.schedule_save()
+
+    def schedule_save(self) -> NoReturn:
+        """Saves the histograms in the background, or right away if there is no running event loop."""
+        try:
+            asyncio.get_running_loop()
+        except RuntimeError:
+            self.save()
+            return
+        if self.save_task is None or self.save_task.done():
+            self.save_task = asyncio.create_task(self.flush())
+
+    def load(self) -> NoReturn:
+        """Loads the histograms from a JSON file."""
+        try:
+            with open(self.path, 'r') as file:
+                data = json.load(file)
+            self.histograms = {int(channel_id): MessageHistogram.from_dict(histogram)
+                               for channel_id, histogram in data.items()}
+        except FileNotFoundError:
+            logging.info("Histogram file not found. Histograms were initialized to {}.")
+        except (json.JSONDecodeError, KeyError):
+            logging.info("Histogram file is likely empty or corrupted. Histograms were initialized to {}.")
+
+    def take_snapshot(self) -> dict:
+        """Returns a copy of the histograms to save and marks them as saved."""
+        self.dirty = False
+        self.last_save = time.monotonic()
+        return {str(channel_id): histogram.to_dict() for channel_id, histogram in self.histograms.items()}
+
+    async def flush(self) -> NoReturn:
+        """Saves the histograms to a JSON file on an executor thread if they have changed."""
+        async with self.save_lock:
+            if not self.dirty:
+                return
+            snapshot = self.take_snapshot()
+            try:
+                await asyncio.get_running_loop().run_in_executor(None, write_json_atomically, self.path, snapshot)
+            except (OSError, ValueError, TypeError) as e:
+                logging.error("Failed to save message histograms: %s", e)
+                self.dirty = True
+
+    def save(self) -> NoReturn:
+        """Synchronously saves the histograms to a JSON file if they have changed, e.g. when there is no event loop
+        to save them from."""
+        if not self.dirty:
+            return
+        try:
+            write_json_atomically(self.path, self.take_snapshot())
+        except (OSError, ValueError, TypeError) as e:
+            logging.error("Failed to save message histograms: %s", e)
+            self.dirty = True
@@ -0,0 +1,240 @@
+import os
+import bisect
+import asyncio
+import logging
+from typing import NoReturn, Optional
+
+
+class Metric:
+    """A named metric with a value per combination of label values."""
+    type_name = "untyped"
+
+    def __init__(self, name: str, description: str, label_names: tuple = ()) -> NoReturn:
+        self.name = name
+        self.description = description
+        self.label_names = label_names
+        self.values = {}
+
+    def key_of(self, labels: dict) -> tuple:
+        return tuple(str(labels.get(label_name, "")) for label_name in self.label_names)
+
+    def format_labels(self, key: tuple, extra: str = "") -> str:
+        pairs = [f'{label_name}="{value}"' for label_name, value in zip(self.label_names, key)]
+        if extra:
+            pairs.append(extra)
+        return "{" + ",".join(pairs) + "}" if pairs else ""
+
+    def render(self) -> list[str]:
+        lines = [f"# HELP {self.name} {self.description}", f"# TYPE {self.name} {self.type_name}"]
+        for key, value in sorted(self.values.items()):
+            lines.append(f"{self.name}{self.format_labels(key)} {value}")
+        return lines
+
+
+class Counter(Metric):
+    type_name = "counter"
+
+    def inc(self, amount: float = 1, **labels) -> NoReturn:
+        key = self.key_of(labels)
+        self.values[key] = self.values.get(key, 0) + amount
+
+    def get(self, **labels) -> float:
+        return self.values.get(self.key_of(labels), 0)
+
+    def total(self) -> float:
+        return sum(self.values.values())
+
+
+class Gauge(Metric):
+    type_name = "gauge"
+
+    def set(self, value: float, **labels) -> NoReturn:
+        self.values[self.key_of(labels)] = value
+
+    def get(self, **labels) -> float:
+        return self.values.get(self.key_of(labels), 0)
+
+
+class Histogram(Metric):
+    """A histogram with cumulative buckets, as Prometheus expects them."""
+    type_name = "histogram"
+    DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+    def __init__(self, name: str, description: str, label_names: tuple = (), buckets: tuple = DEFAULT_BUCKETS) -> NoReturn:
+        super().__init__(name, description, label_names)
+        self.buckets = buckets
+
+    def observe(self, value: float, **labels) -> NoReturn:
+        key = self.key_of(labels)
+        counts, total = self.values.get(key, ([0] * (len(self.buckets) + 1), 0.0))
+        counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.values[key] = (counts, total + value)
+
+    def count(self, **labels) -> int:
+        return sum(self.values[self.key_of(labels)][0]) if self.key_of(labels) in self.values else 0
+
+    def quantile(self, fraction: float, **labels) -> Optional[float]:
+        """Estimates the quantile as the upper bound of the bucket it falls in."""
+        entry = self.values.get(self.key_of(labels))
+        if entry is None:
+            return None
+        counts = entry[0]
+        target, seen = fraction * sum(counts), 0
+        for index, count in enumerate(counts):
+            seen += count
+            if seen >= target:
+                return self.buckets[index] if index < len(self.buckets) else float("inf")
+        return float("inf")
+
+    def render(self) -> list[str]:
+        lines = [f"# HELP {self.name} {self.description}", f"# TYPE {self.name} {self.type_name}"]
+        for key, (counts, total) in sorted(self.values.items()):
+            cumulative = 0
+            for bound, count in zip(self.buckets + ("+Inf",), counts):
+                cumulative += count
+                bucket_labels = self.format_labels(key, 'le="%s"' % bound)
+                lines.append(f"{self.name}_bucket{bucket_labels} {cumulative}")
+            lines.append(f"{self.name}_sum{self.format_labels(key)} {total}")
+            lines.append(f"{self.name}_count{self.format_labels(key)} {cumulative}")
+        return lines
+
+
+class MetricsRegistry:
+    """Holds every metric of the bot and renders them in the Prometheus text format."""
+    def __init__(self) -> NoReturn:
+        self.metrics = []
+
+    def register(self, metric: Metric) -> Metric:
+        self.metrics.append(metric)
+        return metric
+
+    def render(self) -> str:
+        return "\n".join(line for metric in self.metrics for line in metric.render()) + "\n"
+
+
+METRICS = MetricsRegistry()
+COMMAND_LATENCY = METRICS.register(Histogram(
+    "bot_command_latency_seconds", "Time taken to handle a command.", ("command",)))
+RATE_LIMITED_COMMANDS = METRICS.register(Counter(
+    "bot_rate_limited_commands_total", "Commands dropped by the rate limiter."))
+REST_CALLS = METRICS.register(Counter(
+    "bot_rest_calls_total", "REST calls made to Discord.", ("route",)))
+HISTORY_FETCH_LATENCY = METRICS.register(Histogram(
+    "bot_history_fetch_seconds", "Time taken to get a window of candidate messages.", ("source",)))
+EMPTY_WINDOWS = METRICS.register(Counter(
+    "bot_empty_windows_total", "Windows of candidate messages in which no message met the criteria.", ("source",)))
+SEND_LATENCY = METRICS.register(Histogram(
+    "bot_send_message_seconds", "Time taken to send a random message."))
+RETRIES = METRICS.register(Counter(
+    "bot_retries_total", "Retries after an empty window or a failed request.", ("operation",)))
+CIRCUIT_BREAKER_EVENTS = METRICS.register(Counter(
+    "bot_circuit_breaker_events_total", "Guild circuits that were opened and searches they rejected.", ("event",)))
+COALESCED_SEARCHES = METRICS.register(Counter(
+    "bot_coalesced_searches_total", "History searches that were started or joined while already running.",
+    ("role",)))
+SCHEDULED_POSTS = METRICS.register(Counter(
+    "bot_scheduled_posts_total", "Scheduled random messages by result.", ("result",)))
+POLLS_STARTED = METRICS.register(Counter(
+    "bot_polls_started_total", "Poll games that were started."))
+COUNTDOWN_EDITS = METRICS.register(Counter(
+    "bot_countdown_edits_total", "Countdown message edits.", ("kind",)))
+ACTIVE_COUNTDOWNS = METRICS.register(Gauge(
+    "bot_active_countdowns", "Countdowns that haven't revealed their answer yet."))
+CONFIG_WRITE_LATENCY = METRICS.register(Histogram(
+    "bot_config_write_seconds", "Time taken to write the server configurations.", ("backend",)))
+CACHE_LOOKUPS = METRICS.register(Counter(
+    "bot_cache_lookups_total", "Cache lookups by cache and result.", ("cache", "result")))
+STARTUP_PHASE_SECONDS = METRICS.register(Gauge(
+    "bot_startup_phase_seconds", "Time taken by each phase of the last startup.", ("phase",)))
+PROCESS_MEMORY = METRICS.register(Gauge(
+    "bot_process_resident_memory_bytes", "Resident memory of the bot's process."))
+EVENT_LOOP_LAG = METRICS.register(Histogram(
+    "bot_event_loop_lag_seconds", "How late the event loop woke up a sleeping task.",
+    buckets=(0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0)))
+
+
+def instrument_http(http) -> NoReturn:
+    """Counts every REST call made through discord.py's HTTP client by method and route template."""
+    request = http.request
+
+    async def counted_request(route, **kwargs):
+        REST_CALLS.inc(route=f"{route.method} {route.path}")
+        return await request(route, **kwargs)
+    http.request = counted_request
+
+
+async def monitor_event_loop_lag(interval: float = 0.5) -> NoReturn:
+    """Measures how much later than requested the event loop wakes up a sleeping task, forever."""
+    loop = asyncio.get_running_loop()
+    while True:
+        start = loop.time()
+        await asyncio.sleep(interval)
+        EVENT_LOOP_LAG.observe(max(loop.time() - start - interval, 0.0))
+
+
+def process_memory_bytes() -> Optional[int]:
+    """Returns the resident memory of the process, or None where it can't be read."""
+    try:
+        with open("/proc/self/statm") as file:
+            memory = int(file.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, AttributeError):
+        return None
+    PROCESS_MEMORY.set(memory)
+    return memory
+
+
+class MetricsServer:
+    """Serves the metrics in the Prometheus text format over HTTP on a local port."""
+    def __init__(self, port: int, host: str = "127.0.0.1") -> NoReturn:
+        self.host = host
+        self.port = port
+        self.server = None
+
+    async def start(self) -> NoReturn:
+        self.server = await asyncio.start_server(self.handle, self.host, self.port)
+        logging.info("Serving metrics on http://%s:%s/metrics", self.host, self.port)
+
+    async def handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> NoReturn:
+        try:
+            request_line = await asyncio.wait_for(reader.readline(), 5)
+            while (await asyncio.wait_for(reader.readline(), 5)) not in (b"\r\n", b"\n", b""):
+                pass
+            if request_line.split(b" ")[1:2] == [b"/metrics"]:
+                process_memory_bytes()
+                status, body = "200 OK", METRICS.render().encode()
+            else:
+                status, body = "404 Not Found", b"Not found\n"
+            writer.write(f"HTTP/1.1 {status}\r\nContent-Type: text/plain; version=0.0.4\r\n"
+                         f"Content-Length: {len(body)}\r\nConnection: close\r\n\r\n".encode() + body)
+            await writer.drain()
+        except (asyncio.TimeoutError, ConnectionError):
+            pass
+        finally:
+            writer.close()
+
+    def close(self) -> NoReturn:
+        if self.server is not None:
+            self.server.close()
+
+
+def stats_summary() -> str:
+    """Summarizes the metrics for the $stats command."""
+    lines = ["**Bot stats**"]
+    for (command,), (counts, total) in sorted(COMMAND_LATENCY.values.items()):
+        count = sum(counts)
+        lines.append(f"`{command}`: {count} runs, avg {total / count * 1000:.0f}ms, "
+                     f"p99 ≤ {COMMAND_LATENCY.quantile(0.99, command=command) * 1000:.0f}ms")
+    windows = sum(HISTORY_FETCH_LATENCY.count(source=source) for source in ("archive", "history"))
+    lines.append(f"REST calls: {REST_CALLS.total():.0f}, history fetches: "
+                 f"{HISTORY_FETCH_LATENCY.count(source='history')}, archive lookups: "
+                 f"{HISTORY_FETCH_LATENCY.count(source='archive')}")
+    if windows:
+        lines.append(f"Empty windows: {EMPTY_WINDOWS.total() / windows:.1%}, retries: {RETRIES.total():.0f}, "
+                     f"circuits opened: {CIRCUIT_BREAKER_EVENTS.get(event='opened'):.0f}")
+    lookups = {result: CACHE_LOOKUPS.get(cache="channel", result=result) for result in ("gateway", "lru", "miss")}
+    if sum(lookups.values()):
+        lines.append(f"Channel cache hit rate: {1 - lookups['miss'] / sum(lookups.values()):.1%}")
+    lag = EVENT_LOOP_LAG.quantile(0.99)
+    if lag is not None:
+        lines.append(f"Event loop lag p99 ≤ {lag * 1000:.0f}ms, rate limited commands: {RATE_LIMITED_COMMANDS.total():.0f}")
+    return "\n".join(lines)
@@ -2,19 +2,27 @@ import discord
 import random
 import logging
 import asyncio
-from helper_funcs import HelperFuncs
-from typing import NoReturn, Optional
+from typing import Optional
 from random_message import RandomMessage
 from config_manager import ConfigManager
+from countdown_scheduler import CountdownScheduler
+from author_index import AuthorIndex
+from message_archive import ArchivedMessage
+from constants import KEY_SELECT_FROM
+from metrics import POLLS_STARTED
+from keyword_index import tokenize
 
 
 class PollGames:
-    def __init__(self, random_message_manager: RandomMessage, config_manager: ConfigManager):
+    def __init__(self, random_message_manager: RandomMessage, config_manager: ConfigManager,
+                 countdown_scheduler: CountdownScheduler, author_index: AuthorIndex):
         self.random_message_manager = random_message_manager
         self.config_manager = config_manager
+        self.countdown_scheduler = countdown_scheduler
+        self.author_index = author_index
 
-    async def pollgame_who_sent_it(self, message: discord.Message, retries: int = 0):
-        # Generate a list of (up to) 101 random messages, shuffle the list, and get the first message for the poll
+    async def pollgame_who_sent_it(self, message: discord.Message):
+        # Pick a random message for the poll and draw the wrong answers from the source channel's active authors
         channel = message.channel
         duration = self.get_duration_from_message(message.content)
         if duration is None:
@@ -22,25 +30,26 @@ class PollGames:
             return
 
         config = self.config_manager.load_guild_config(channel.guild.id)
-        random_date = HelperFuncs.generate_random_date_time(config)
-        random_messages = await self.random_message_manager.get_random_messages(config, random_date)
-        random.shuffle(random_messages)
-
+        keywords = self.get_keywords_from_message(message.content)
+        try:
+            random_messages = await self.random_message_manager.find_candidates(channel.guild.id, config, keywords)
+        except discord.Forbidden:
+            logging.error("Permissions error when accessing channel history.", extra={"guild": channel.guild.id})
+            return
+        except discord.HTTPException:
+            logging.error("Network error when fetching message history.", extra={"guild": channel.guild.id})
+            return
         if not random_messages:
-            await self.retry_pollgame_who_sent_it(channel, retries)
+            logging.info("No message meeting the criteria was found for pollgame_who_sent_it, stopping.",
+                         extra={"guild": channel.guild.id})
             return
 
-        poll_message = random_messages[0]
-        poll_message_correct_user = poll_message.author.name
-        poll_message_incorrect_users = []
-
-        for random_message in random_messages[1:]:
-            if (random_message.author.name != poll_message_correct_user and len(poll_message_incorrect_users) < 2
-                    and random_message.author.name not in poll_message_incorrect_users):
-                poll_message_incorrect_users.append(random_message.author.name)
-
+        poll_message = random.choice(random_messages)
+        poll_message_correct_user = poll_message.author_name
+        poll_message_incorrect_users = self.draw_incorrect_users(int(config[KEY_SELECT_FROM]), poll_message_correct_user,
+                                                                 random_messages)
         if len(poll_message_incorrect_users) < 2:
-            await self.retry_pollgame_who_sent_it(channel, retries + 1)
+            await channel.send("Not enough different users have sent messages in the source channel for a poll.")
             return
 
         # Create the poll message
@@ -51,31 +60,43 @@ class PollGames:
         poll = await channel.send(poll_content)
         for i in range(len(choices)):
             await poll.add_reaction(f"{i + 1}\u20E3")  # 1️⃣, 2️⃣, 3️⃣, etc.
+        POLLS_STARTED.inc()
         await self.start_countdown(channel, duration, poll_message_correct_user)
 
-    async def retry_pollgame_who_sent_it(self, channel, retries: int) -> NoReturn:
-        if retries < 3:
-            await self.pollgame_who_sent_it(channel, retries + 1)
-        else:
-            logging.info("Max retries reached for pollgame_who_sent_it, stopping.")
+    def draw_incorrect_users(self, source_channel_id: int, correct_user: str,
+                             random_messages: list[ArchivedMessage]) -> list[str]:
+        """Draws two users other than the correct one from the source channel's author index, falling back to the
+        authors of the fetched messages."""
+        if not self.author_index.has_channel(source_channel_id):
+            message_archive = self.random_message_manager.message_archive
+            bot_id = self.random_message_manager.bot.user.id
+            for author_name, created_at in message_archive.recent_authors(source_channel_id, bot_id):
+                self.author_index.record(source_channel_id, author_name, created_at)
 
-    @staticmethod
-    async def start_countdown(channel: discord.TextChannel, duration: int, answer: str):
-        # Send the initial countdown message
-        countdown_message = await channel.send(f"Countdown: {duration}")
+        incorrect_users = self.author_index.draw(source_channel_id, 2, exclude={correct_user})
+        for random_message in random_messages:
+            if len(incorrect_users) >= 2:
+                break
+            if random_message.author_name != correct_user and random_message.author_name not in incorrect_users:
+                incorrect_users.append(random_message.author_name)
+        return incorrect_users
 
-        for remaining in range(duration, 0, -1):
-            await asyncio.sleep(1)  # Wait for 1 second
-            await countdown_message.edit(content=f"Countdown: {remaining}")
+    async def start_countdown(self, channel: discord.TextChannel, duration: int, answer: str) -> asyncio.Future:
+        # The scheduler updates the countdown and reveals the answer once it's over
+        return await self.countdown_scheduler.start(channel, duration, answer)
 
-        await countdown_message.edit(content=f"Answer: {answer}")
+    @staticmethod
+    def get_keywords_from_message(content: str) -> frozenset[str]:
+        """Extracts the keywords the poll's message must contain, which follow the duration, from the message
+        content."""
+        return tokenize(" ".join(content.split()[2:]))
 
     @staticmethod
     def get_duration_from_message(content: str) -> Optional[int]:
         """Extracts the duration from the message content."""
         try:
             # Split the content and get the second part
-            _, duration_str = content.split()
+            duration_str = content.split()[1]
             duration = int(duration_str)
             return duration if duration > 0 else None
         except (ValueError, IndexError):
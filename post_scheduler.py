@@ -0,0 +1,170 @@
+import time
+import heapq
+import random
+import asyncio
+import discord
+import logging
+import itertools
+from datetime import datetime, timezone
+from typing import NoReturn, Optional
+from config_manager import ConfigManager
+from candidate_pool import CandidatePool
+from random_message import RandomMessage
+from rate_limiter import TokenBucket
+from metrics import SCHEDULED_POSTS
+from constants import KEY_GUILD_NAME, KEY_SELECT_FROM, KEY_SEND_TO, KEY_SCHEDULE_HOURS, KEY_NEXT_POST_AT
+
+
+class PostScheduler:
+    """Posts random messages in the guilds that scheduled them, every few hours, from a single task.
+
+    The guilds are kept in a heap ordered by when they are due. Entries aren't removed when a schedule changes;
+    instead, an entry is ignored if it no longer matches the guild's due time. Each guild's next post is stored in
+    its configuration, so schedules survive restarts. Guilds that missed posts while the bot was down get a single
+    catch-up post, spread over the first few minutes after startup.
+
+    New schedules start at a random offset and posts are rate capped, so guilds that scheduled posts at the same time
+    don't all search for messages at once.
+
+    Attributes:
+        bot (discord.Client): The bot instance, whose guilds can be posted in.
+        config_manager (ConfigManager): Stores the schedules.
+        candidate_pool (CandidatePool): Provides the messages to post.
+        random_message (RandomMessage): Sends the messages.
+        heap (list[tuple[float, int, int]]): The due times of the guilds' next posts and their guild IDs.
+        due_at (dict[int, float]): The timestamp of each scheduled guild's next post, keyed by guild ID.
+    """
+    MIN_HOURS = 1
+    MAX_HOURS = 24 * 30
+    MAX_START_JITTER_SECONDS = 600
+    CATCH_UP_SPREAD_SECONDS = 300
+    POST_BURST = 10
+    POSTS_PER_SECOND = 1.0
+
+    def __init__(self, bot: discord.Client, config_manager: ConfigManager, candidate_pool: CandidatePool,
+                 random_message: RandomMessage) -> NoReturn:
+        self.bot = bot
+        self.config_manager = config_manager
+        self.candidate_pool = candidate_pool
+        self.random_message = random_message
+        self.heap = []
+        self.due_at = {}
+        self.counter = itertools.count()
+        self.wakeup = asyncio.Event()
+        self.post_bucket = TokenBucket(self.POST_BURST, self.POSTS_PER_SECOND)
+        self.runner = None
+        self.post_tasks = set()
+
+    def load(self) -> NoReturn:
+        """Schedules the next post of every guild of the bot that has a schedule, catching up on missed posts."""
+        self.heap, self.due_at = [], {}
+        now = time.time()
+        for guild in self.bot.guilds:
+            config = self.config_manager.server_configs.get(str(guild.id))
+            if config is None or config.get(KEY_SCHEDULE_HOURS) is None:
+                continue
+            next_post_at = config.get(KEY_NEXT_POST_AT)
+            due_at = datetime.fromisoformat(next_post_at).timestamp() if next_post_at else now
+            if due_at <= now:
+                due_at = now + random.uniform(0, self.CATCH_UP_SPREAD_SECONDS)
+                logging.info("Catching up on the scheduled post of %s.", guild.name, extra={"guild": guild.id})
+            self.push(guild.id, due_at)
+        self.start()
+
+    def set_schedule(self, guild_id: int, hours: Optional[float]) -> Optional[datetime]:
+        """Posts in the guild every `hours` hours from now on, or stops posting if `hours` is None.
+
+        Returns:
+            Optional[datetime]: When the first post is due, if there is a schedule.
+        """
+        config = self.config_manager.server_configs[str(guild_id)]
+        config[KEY_SCHEDULE_HOURS] = hours
+        if hours is None:
+            config[KEY_NEXT_POST_AT] = None
+            self.due_at.pop(guild_id, None)
+            self.config_manager.mark_dirty(guild_id)
+            return None
+        interval = hours * 3600
+        due_at = time.time() + interval + random.uniform(0, min(interval / 10, self.MAX_START_JITTER_SECONDS))
+        self.push(guild_id, due_at)
+        self.start()
+        return datetime.fromtimestamp(due_at, timezone.utc)
+
+    def push(self, guild_id: int, due_at: float) -> NoReturn:
+        """Schedules the guild's next post and stores it in the guild's configuration."""
+        self.due_at[guild_id] = due_at
+        heapq.heappush(self.heap, (due_at, next(self.counter), guild_id))
+        config = self.config_manager.server_configs.get(str(guild_id))
+        next_post_at = datetime.fromtimestamp(due_at, timezone.utc).isoformat()
+        if config is not None and config.get(KEY_NEXT_POST_AT) != next_post_at:
+            config[KEY_NEXT_POST_AT] = next_post_at
+            self.config_manager.mark_dirty(guild_id)
+        self.wakeup.set()
+
+    def start(self) -> NoReturn:
+        if self.runner is None or self.runner.done():
+            self.runner = asyncio.create_task(self.run())
+
+    async def run(self) -> NoReturn:
+        """Posts in the guilds as they become due, until no guild has a schedule."""
+        while self.heap:
+            due_at, _, guild_id = self.heap[0]
+            if self.due_at.get(guild_id) != due_at:
+                heapq.heappop(self.heap)
+                continue
+            delay = due_at - time.time()
+            if delay <= 0 and not self.post_bucket.has_token(time.monotonic()):
+                delay = (1 - self.post_bucket.tokens) / self.POSTS_PER_SECOND
+            if delay > 0:
+                self.wakeup.clear()
+                try:
+                    await asyncio.wait_for(self.wakeup.wait(), delay)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+
+            heapq.heappop(self.heap)
+            self.post_bucket.take()
+            config = self.config_manager.server_configs.get(str(guild_id))
+            if config is None or config.get(KEY_SCHEDULE_HOURS) is None:
+                self.due_at.pop(guild_id, None)
+                continue
+            self.post(guild_id, config)
+            # Missed posts are skipped rather than posted one after another
+            interval = config[KEY_SCHEDULE_HOURS] * 3600
+            next_due_at = due_at + interval
+            if next_due_at <= time.time():
+                next_due_at = time.time() + interval
+            self.push(guild_id, next_due_at)
+
+    def post(self, guild_id: int, config: dict) -> NoReturn:
+        """Sends a random message in the background, so a slow post doesn't delay the other guilds."""
+        task = asyncio.create_task(self.post_message(guild_id, config))
+        self.post_tasks.add(task)
+        task.add_done_callback(self.post_tasks.discard)
+
+    async def post_message(self, guild_id: int, config: dict) -> NoReturn:
+        if self.bot.get_guild(guild_id) is None or config[KEY_SELECT_FROM] is None or config[KEY_SEND_TO] is None:
+            SCHEDULED_POSTS.inc(result="skipped")
+            return
+        candidates = await self.candidate_pool.take(guild_id)
+        if not candidates:
+            SCHEDULED_POSTS.inc(result="empty")
+            logging.info("No candidate message could be found for the scheduled post of %s.", config[KEY_GUILD_NAME],
+                         extra={"guild": guild_id})
+            return
+        try:
+            await self.random_message.send_message(config[KEY_SEND_TO], candidates[0])
+        except discord.HTTPException as e:
+            SCHEDULED_POSTS.inc(result="failed")
+            logging.error("Failed to send the scheduled post of %s: %s", config[KEY_GUILD_NAME], e,
+                          extra={"guild": guild_id})
+            return
+        SCHEDULED_POSTS.inc(result="sent")
+
+    def shutdown(self) -> NoReturn:
+        """Cancels the scheduler and every post being sent."""
+        if self.runner is not None:
+            self.runner.cancel()
+        for task in self.post_tasks:
+            task.cancel()
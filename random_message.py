@@ -1,66 +1,219 @@
 import discord
 import logging
-import random
 import asyncio
+import time
 from helper_funcs import HelperFuncs
-from typing import NoReturn
-from datetime import datetime
+from typing import NoReturn, Optional
+from datetime import datetime, timezone
 from config_manager import ConfigManager
-from constants import (KEY_SELECT_FROM, KEY_SEND_TO, KEY_ENABLE_ATTACHMENTS, KEY_ENABLE_URLS, KEY_ENABLE_MENTIONS)
+from message_archive import MessageArchive, ArchivedMessage
+from message_histogram import HistogramStore
+from message_filter import FilterCache
+from channel_resolver import ChannelResolver
+from author_index import AuthorIndex
+from retry_policy import RetryPolicy, CircuitBreaker
+from single_flight import SingleFlight
+from keyword_index import tokenize
+from metrics import HISTORY_FETCH_LATENCY, EMPTY_WINDOWS, SEND_LATENCY, RETRIES
+from constants import (KEY_GUILD_NAME, KEY_SELECT_FROM, KEY_START_DATE, KEY_ENABLE_ATTACHMENTS,
+                       KEY_ENABLE_URLS, KEY_ENABLE_MENTIONS)
 
 
 class RandomMessage:
-    """Manages the fetching and sending of random messages within the Discord bot."""
-    def __init__(self, bot: discord.Client, config_manager: ConfigManager) -> NoReturn:
+    """Manages the fetching and sending of random messages within the Discord bot.
+
+    Attributes:
+        retry_policy (RetryPolicy): Decides where to search for candidate messages and how to retry failed requests.
+        circuit_breaker (CircuitBreaker): Stops searching the source channels of guilds that keep failing.
+        searches (SingleFlight): Coalesces concurrent searches of the same source channel.
+        search_limits (dict[int, asyncio.Semaphore]): Bounds the number of concurrent searches, keyed by guild ID.
+    """
+    MAX_CONCURRENT_SEARCHES = 2
+    MAX_SHARED_SEARCHES = 2
+
+    def __init__(self, bot: discord.Client, config_manager: ConfigManager, message_archive: MessageArchive,
+                 histograms: HistogramStore, channel_resolver: ChannelResolver, author_index: AuthorIndex) -> NoReturn:
         self.bot = bot
+        self.author_index = author_index
         self.config_manager = config_manager
+        self.channel_resolver = channel_resolver
+        self.message_archive = message_archive
+        self.histograms = histograms
+        self.filters = FilterCache()
+        self.retry_policy = RetryPolicy()
+        self.circuit_breaker = CircuitBreaker()
+        self.searches = SingleFlight()
+        self.search_limits = {}
+
+    async def find_candidates(self, guild_id: int, config: dict,
+                              keywords: frozenset[str] = frozenset()) -> list[ArchivedMessage]:
+        """Finds messages that meet the guild's criteria and contain every keyword, from the archive or by searching
+        the source channel's history.
+
+        Concurrent searches of the same channel for the same keywords are coalesced into one, whose messages are
+        split between the callers. A caller whose share is empty because the search found fewer messages than there
+        were callers searches again. Each guild runs at most `MAX_CONCURRENT_SEARCHES` searches at once; the others
+        wait for their turn. History isn't searched while the guild's circuit breaker is open, but the archive,
+        which makes no API calls, still is.
+
+        Returns:
+            list[ArchivedMessage]: The caller's share of the messages found, or an empty list if none were.
 
-    async def send_random_message_around_random_date(self, guild_id: int, retries: int = 0) -> NoReturn:
-        """Main function to fetch a random message and send it based on criteria."""
-        if retries >= 3:
-            logging.info(f"Max retries reached for guild_id={guild_id}, stopping.")
-            return
-        try:
-            config = self.config_manager.load_guild_config(guild_id)
-            random_date = HelperFuncs.generate_random_date_time(config)
-            random_messages = await self.get_random_messages(config, random_date)
-            random.shuffle(random_messages)
-            # Loop through messages and send the first valid one
-            for random_message in random_messages:
-                logging.info(f"Random messages sent: '{random_message.content}' from '{random_message.author}' at "
-                             f"'{random_message.created_at}'")
-                await self.send_message(config[KEY_SEND_TO], random_message)
-                # noinspection PyUnreachableCode
-                return  # Stop after first valid message is found
-            # Retry if no valid message was found and sent
-            await self.retry_send_message(guild_id, retries)
-
-        except discord.Forbidden:
-            logging.error("Permissions error when accessing channel history.")
-            await self.retry_send_message(guild_id, retries)
-        except discord.HTTPException:
-            logging.error("Network error when fetching message history.")
-            await self.retry_send_message(guild_id, retries)
-
-    async def get_random_messages(self, config: dict, date: datetime) -> list[discord.Message]:
-        """Fetches (up to) 100 random messages from the channel history around a specified datetime."""
-        channel = await self.bot.fetch_channel(config[KEY_SELECT_FROM])
-        messages = [message async for message in channel.history(limit=100, around=date)
-                    if HelperFuncs.meets_message_criteria(config, message)]
-
-        logging.info(f"Fetched {len(messages)} messages from #{channel.name} in {channel.guild.name}")
+        Raises:
+            discord.Forbidden: If the bot does not have permissions to read the source channel.
+            discord.HTTPException: If fetching history kept failing.
+        """
+        archived_messages = self.sample_archive(config, keywords)
+        if archived_messages is not None:
+            return archived_messages
+        if not self.circuit_breaker.allow(guild_id):
+            logging.info("Not searching %s while its circuit is open.", config[KEY_GUILD_NAME],
+                         extra={"guild": guild_id})
+            return []
+
+        key = (guild_id, config[KEY_SELECT_FROM], keywords)
+        messages = []
+        for _ in range(self.MAX_SHARED_SEARCHES):
+            messages, found = await self.searches.do(key, lambda: self.search_history(guild_id, config, keywords))
+            if messages or not found:
+                break
         return messages
 
-    async def send_message(self, channel_id: int, message: discord.Message) -> NoReturn:
+    async def search_history(self, guild_id: int, config: dict,
+                             keywords: frozenset[str] = frozenset()) -> list[ArchivedMessage]:
+        """Searches the source channel's history following the retry policy, once the guild's concurrency limit
+        allows it.
+
+        The windows around a random date are searched before another date is drawn, and failed requests are retried
+        after backing off. Searches for keywords that find nothing don't count as failures, since rare keywords are
+        expected to miss.
+
+        Returns:
+            list[ArchivedMessage]: The messages of the first window that had any, or an empty list if none did.
+
+        Raises:
+            discord.Forbidden: If the bot does not have permissions to read the source channel.
+            discord.HTTPException: If fetching history kept failing.
+        """
+        search_limit = self.search_limits.setdefault(guild_id, asyncio.Semaphore(self.MAX_CONCURRENT_SEARCHES))
+        async with search_limit:
+            return await self.search_windows(guild_id, config, keywords)
+
+    async def search_windows(self, guild_id: int, config: dict, keywords: frozenset[str]) -> list[ArchivedMessage]:
+        oldest_id = newest_id = None
+        fetches = 0
+        for step in self.retry_policy.steps():
+            if step == "around":
+                position = {"around": self.generate_random_date(config)}
+            elif step == "before" and oldest_id is not None:
+                position = {"before": oldest_id}
+            elif step == "after" and newest_id is not None:
+                position = {"after": newest_id}
+            else:
+                continue
+            if fetches:
+                RETRIES.inc(operation=f"search_{step}")
+            fetches += 1
+            messages, window_oldest_id, window_newest_id = await self.fetch_with_backoff(guild_id, config, position)
+            if keywords:
+                messages = [message for message in messages if keywords <= tokenize(message.content)]
+            if messages:
+                self.circuit_breaker.record_success(guild_id)
+                return messages
+            if step == "around":
+                oldest_id, newest_id = window_oldest_id, window_newest_id
+            elif step == "before":
+                oldest_id = window_oldest_id
+            else:
+                newest_id = window_newest_id
+        if not keywords:
+            self.circuit_breaker.record_failure(guild_id)
+        return []
+
+    async def fetch_with_backoff(self, guild_id: int, config: dict,
+                                 position: dict) -> tuple[list[ArchivedMessage], Optional[int], Optional[int]]:
+        """Fetches a window of history, retrying after the delay the retry policy asks for when requests fail."""
+        retries = 0
+        while True:
+            try:
+                return await self.fetch_window(config, **position)
+            except discord.HTTPException as error:
+                delay = self.retry_policy.backoff(error, retries)
+                if delay is None:
+                    self.circuit_breaker.record_failure(
+                        guild_id, permanent=isinstance(error, (discord.Forbidden, discord.NotFound)))
+                    raise
+                retries += 1
+                RETRIES.inc(operation="http_error")
+                logging.warning("Fetching history in %s failed with status %s, retrying in %.1fs.",
+                                config[KEY_GUILD_NAME], error.status, delay, extra={"guild": guild_id})
+                await asyncio.sleep(delay)
+
+    def sample_archive(self, config: dict, keywords: frozenset[str] = frozenset()) -> Optional[list[ArchivedMessage]]:
+        """Selects a window of messages meeting the criteria and containing the keywords from the archive, or returns
+        None if the source channel hasn't been fully archived and indexed yet."""
+        start = time.perf_counter()
+        archived_messages = self.message_archive.sample(config, self.bot.user.id, keywords)
+        if archived_messages is not None:
+            HISTORY_FETCH_LATENCY.observe(time.perf_counter() - start, source="archive")
+            if not archived_messages:
+                EMPTY_WINDOWS.inc(source="archive")
+        return archived_messages
+
+    async def fetch_window(self, config: dict, around: Optional[datetime] = None, before: Optional[int] = None,
+                           after: Optional[int] = None) -> tuple[list[ArchivedMessage], Optional[int], Optional[int]]:
+        """Fetches (up to) 100 messages from the source channel around a datetime, or right before or after a
+        message, and keeps those that meet the criteria.
+
+        Returns:
+            tuple: The messages meeting the criteria, and the IDs of the oldest and newest fetched messages, or None
+            if nothing was fetched.
+        """
+        start = time.perf_counter()
+        channel = await self.channel_resolver.resolve(config[KEY_SELECT_FROM])
+        if around is not None:
+            history = [message async for message in channel.history(limit=100, around=around)]
+        elif before is not None:
+            history = [message async for message in channel.history(limit=100, before=discord.Object(id=before))]
+        else:
+            history = [message async for message in channel.history(limit=100, after=discord.Object(id=after))]
+        message_filter = self.filters.get(channel.id, config)
+        messages = [ArchivedMessage.from_message(message) for message in message_filter.filter_batch(history)]
+        self.histograms.observe(channel.id, [message.created_at for message in history], len(messages))
+        for message in history:
+            if message.author.id != self.bot.user.id:
+                self.author_index.record(channel.id, message.author.name, message.created_at)
+        HISTORY_FETCH_LATENCY.observe(time.perf_counter() - start, source="history")
+        if not messages:
+            EMPTY_WINDOWS.inc(source="history")
+        if history and not messages:
+            logging.info("No message in the fetched window met the criteria of %s, filter stats: %s",
+                         config[KEY_GUILD_NAME], message_filter.stats_summary(), extra={"guild": channel.guild.id})
+
+        logging.debug("Fetched %s messages from #%s in %s", len(messages), channel.name, channel.guild.name,
+                      extra={"guild": channel.guild.id})
+        if not history:
+            return messages, None, None
+        message_ids = [message.id for message in history]
+        return messages, min(message_ids), max(message_ids)
+
+    def generate_random_date(self, config: dict) -> datetime:
+        """Generates a random datetime weighted by the source channel's message histogram."""
+        histogram = self.histograms.get(config[KEY_SELECT_FROM])
+        random_date = HelperFuncs.generate_random_date_time(config, histogram)
+        if logging.getLogger().isEnabledFor(logging.DEBUG):
+            expected_calls = histogram.expected_api_calls(datetime.fromisoformat(config[KEY_START_DATE]),
+                                                          datetime.now(timezone.utc))
+            logging.debug("Expected history calls per draw in %s: %.2f", config[KEY_GUILD_NAME], expected_calls)
+        return random_date
+
+    async def send_message(self, channel_id: int, message: ArchivedMessage) -> NoReturn:
         """Sends the message content or attachment to the specified channel."""
-        channel = await self.bot.fetch_channel(channel_id)
-        if message.attachments:
-            await channel.send(message.attachments[0].url)
+        start = time.perf_counter()
+        channel = await self.channel_resolver.resolve(channel_id)
+        if message.attachment_url:
+            await channel.send(message.attachment_url)
         else:
             await channel.send(message.content)
-        logging.info(f"Message sent in {channel.name}: '{message.content}'")
-
-    async def retry_send_message(self, guild_id: int, retries: int) -> NoReturn:
-        """Retries sending a message after a short delay."""
-        await asyncio.sleep(0.5)
-        await self.send_random_message_around_random_date(guild_id, retries + 1)
+        SEND_LATENCY.observe(time.perf_counter() - start)
+        logging.debug("Message sent in %s: '%s'", channel.name, message.content)
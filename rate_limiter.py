@@ -0,0 +1,68 @@
+import time
+from typing import NoReturn
+
+
+class TokenBucket:
+    """A token bucket that allows bursts of up to `capacity` actions and refills at `refill_rate` tokens per second."""
+    __slots__ = ("capacity", "refill_rate", "tokens", "updated_at")
+
+    def __init__(self, capacity: float, refill_rate: float) -> NoReturn:
+        self.capacity = capacity
+        self.refill_rate = refill_rate
+        self.tokens = capacity
+        self.updated_at = time.monotonic()
+
+    def refill(self, now: float) -> NoReturn:
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated_at) * self.refill_rate)
+        self.updated_at = now
+
+    def is_full(self, now: float) -> bool:
+        self.refill(now)
+        return self.tokens >= self.capacity
+
+    def has_token(self, now: float) -> bool:
+        self.refill(now)
+        return self.tokens >= 1
+
+    def take(self) -> NoReturn:
+        self.tokens -= 1
+
+
+class CommandRateLimiter:
+    """Limits how many commands each guild and each user can run, so floods of commands can't pile up history
+    fetches.
+
+    Attributes:
+        guild_buckets (dict[int, TokenBucket]): The token buckets of the guilds.
+        user_buckets (dict[int, TokenBucket]): The token buckets of the users.
+    """
+    GUILD_CAPACITY = 10
+    GUILD_REFILL_PER_SECOND = 0.5
+    USER_CAPACITY = 3
+    USER_REFILL_PER_SECOND = 0.2
+    MAX_BUCKETS = 10000
+
+    def __init__(self) -> NoReturn:
+        self.guild_buckets = {}
+        self.user_buckets = {}
+
+    def allow(self, guild_id: int, user_id: int) -> bool:
+        """Takes a token from both the guild's and the user's bucket if both have one."""
+        now = time.monotonic()
+        guild_bucket = self.get_bucket(self.guild_buckets, guild_id, self.GUILD_CAPACITY, self.GUILD_REFILL_PER_SECOND, now)
+        user_bucket = self.get_bucket(self.user_buckets, user_id, self.USER_CAPACITY, self.USER_REFILL_PER_SECOND, now)
+        if not (guild_bucket.has_token(now) and user_bucket.has_token(now)):
+            return False
+        guild_bucket.take()
+        user_bucket.take()
+        return True
+
+    def get_bucket(self, buckets: dict, key: int, capacity: float, refill_rate: float, now: float) -> TokenBucket:
+        """Returns the bucket for the key, creating it and pruning idle buckets if necessary."""
+        bucket = buckets.get(key)
+        if bucket is None:
+            if len(buckets) >= self.MAX_BUCKETS:
+                for idle_key in [idle_key for idle_key, idle in buckets.items() if idle.is_full(now)]:
+                    del buckets[idle_key]
+            bucket = buckets[key] = TokenBucket(capacity, refill_rate)
+        return bucket
@@ -0,0 +1,90 @@
+import time
+import random
+import logging
+import discord
+from typing import Iterator, NoReturn, Optional
+from metrics import CIRCUIT_BREAKER_EVENTS
+
+
+class RetryPolicy:
+    """Decides where to look for candidate messages next and how long to wait after a failed request.
+
+    The window around a random date is searched first, then the windows right before and after it, which are cheap
+    to reach by paginating from the first window's edges and are likely to have a similar density of messages.
+    Only then is a new random date drawn.
+
+    Failed requests are retried after the delay Discord asked for on 429 responses, or after an exponentially
+    growing, jittered delay on server errors. Other errors, like missing permissions, can't be fixed by retrying.
+    """
+    SEARCH_STEPS = ("around", "before", "after")
+    MAX_FETCHES = 6
+    MAX_ERROR_RETRIES = 3
+    BASE_DELAY_SECONDS = 0.5
+    MAX_DELAY_SECONDS = 10.0
+
+    def steps(self) -> Iterator[str]:
+        """Yields where each fetch should look: around a new random date, or before or after the fetched windows."""
+        for fetch in range(self.MAX_FETCHES):
+            yield self.SEARCH_STEPS[fetch % len(self.SEARCH_STEPS)]
+
+    def backoff(self, error: discord.HTTPException, retries: int) -> Optional[float]:
+        """Returns how many seconds to wait before retrying the failed request, or None if it shouldn't be retried."""
+        if isinstance(error, (discord.Forbidden, discord.NotFound)) or retries >= self.MAX_ERROR_RETRIES:
+            return None
+        if error.status == 429:
+            response = getattr(error, "response", None)
+            retry_after = response.headers.get("Retry-After") if response is not None else None
+            if retry_after is not None:
+                return min(float(retry_after), self.MAX_DELAY_SECONDS)
+        elif error.status < 500:
+            return None
+        return random.uniform(0, min(self.BASE_DELAY_SECONDS * 2 ** retries, self.MAX_DELAY_SECONDS))
+
+
+class CircuitBreaker:
+    """Stops searching a guild's source channel for a while once it keeps failing, so commands in that guild don't
+    spend API calls on searches that are very unlikely to succeed.
+
+    The circuit of a guild opens after `FAILURE_THRESHOLD` failed searches in a row, or right away after a permission
+    error. Once `OPEN_SECONDS` have passed, a search is let through again and a single failure reopens the circuit.
+
+    Attributes:
+        failures (dict[int, int]): The number of failed searches in a row, keyed by guild ID.
+        open_until (dict[int, float]): When the open circuits can be retried, keyed by guild ID.
+    """
+    FAILURE_THRESHOLD = 3
+    OPEN_SECONDS = 300
+
+    def __init__(self) -> NoReturn:
+        self.failures = {}
+        self.open_until = {}
+
+    def allow(self, guild_id: int) -> bool:
+        """Checks whether the guild's source channel can be searched."""
+        open_until = self.open_until.get(guild_id)
+        if open_until is None:
+            return True
+        if time.monotonic() < open_until:
+            CIRCUIT_BREAKER_EVENTS.inc(event="rejected")
+            return False
+        del self.open_until[guild_id]
+        self.failures[guild_id] = self.FAILURE_THRESHOLD - 1
+        return True
+
+    def record_success(self, guild_id: int) -> NoReturn:
+        self.reset(guild_id)
+
+    def record_failure(self, guild_id: int, permanent: bool = False) -> NoReturn:
+        """Counts a failed search, opening the guild's circuit if it failed too often or can't succeed."""
+        failures = self.FAILURE_THRESHOLD if permanent else self.failures.get(guild_id, 0) + 1
+        self.failures[guild_id] = failures
+        if failures >= self.FAILURE_THRESHOLD and guild_id not in self.open_until:
+            self.open_until[guild_id] = time.monotonic() + self.OPEN_SECONDS
+            CIRCUIT_BREAKER_EVENTS.inc(event="opened")
+            logging.warning("Opened the circuit of guild %s for %ss after %s failed searches.", guild_id,
+                            self.OPEN_SECONDS, failures, extra={"guild": guild_id})
+
+    def reset(self, guild_id: int) -> NoReturn:
+        """Closes the guild's circuit, e.g. after its configuration changed."""
+        self.failures.pop(guild_id, None)
+        self.open_until.pop(guild_id, None)
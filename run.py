@@ -1,5 +1,9 @@
 from bot_main import Bot
+from log_setup import configure_logging
+from shard_supervisor import ShardSupervisor
 from dotenv import load_dotenv
+import argparse
+import logging
 import os
 
 # Load .env file to get the BOT_TOKEN
@@ -8,10 +12,29 @@ env_file_path = os.path.join(script_dir, '.env')
 load_dotenv(env_file_path)
 
 
+def parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="Runs the random message bot.")
+    parser.add_argument("--workers", type=int, default=int(os.environ.get("SHARD_WORKERS", 0)),
+                        help="Run the bot auto-sharded across this many worker processes (default: a single process).")
+    parser.add_argument("--shards", type=int, default=int(os.environ.get("SHARD_COUNT", 0)),
+                        help="The total number of shards when running workers (default: one per worker).")
+    return parser.parse_args()
+
+
 def main():
+    args = parse_args()
     token = str(os.environ.get("BOT_TOKEN"))
-    bot1 = Bot(token)
-    bot1.run_bot()
+    log_level = logging.getLevelName(os.environ.get("LOG_LEVEL", "INFO"))
+    log_listener = configure_logging(level=log_level, rotate_when=os.environ.get("LOG_ROTATE_WHEN"))
+    try:
+        if args.workers > 0:
+            supervisor = ShardSupervisor(token, args.shards or args.workers, args.workers, log_level)
+            supervisor.run()
+        else:
+            bot1 = Bot(token)
+            bot1.run_bot()
+    finally:
+        log_listener.stop()
 
 
 if __name__ == "__main__":
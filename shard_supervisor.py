@@ -0,0 +1,128 @@
+import os
+import time
+import signal
+import logging
+import multiprocessing
+from typing import NoReturn
+from bot_main import ShardedBot
+from log_setup import configure_logging
+
+
+def run_worker(token: str, worker_index: int, shard_ids: list[int], shard_count: int, log_level: int) -> NoReturn:
+    """Runs the given shards in the current process until the bot is closed.
+
+    Every worker logs to its own file, since a rotating log file can't safely be shared between processes.
+    """
+    log_listener = configure_logging(f"logs.worker-{worker_index}.txt", level=log_level)
+    try:
+        bot = ShardedBot(token, worker_index, shard_ids=shard_ids, shard_count=shard_count)
+        bot.run_bot()
+    finally:
+        log_listener.stop()
+
+
+class ShardSupervisor:
+    """Splits the bot's shards across worker processes and restarts the workers that exit unexpectedly.
+
+    Shard `i` runs in worker `i % worker_count`. Workers are started one after another, leaving enough time between
+    them for their shards to identify without exceeding Discord's identify rate limit. A worker that keeps failing
+    is restarted after an exponentially growing delay, which is reset once it stays up for a while.
+
+    Attributes:
+        token (str): The Discord bot token used for authentication.
+        shard_count (int): The total number of shards.
+        worker_count (int): The number of worker processes.
+        log_level (int): The log level of the workers.
+        workers (dict[int, multiprocessing.Process]): The running worker processes, keyed by worker index.
+        failures (dict[int, int]): How many times in a row each worker failed shortly after being started.
+    """
+    IDENTIFY_INTERVAL_SECONDS = 5
+    RESTART_BASE_DELAY_SECONDS = 5
+    RESTART_MAX_DELAY_SECONDS = 300
+    STABLE_UPTIME_SECONDS = 600
+    POLL_INTERVAL_SECONDS = 1
+    SHUTDOWN_TIMEOUT_SECONDS = 30
+
+    def __init__(self, token: str, shard_count: int, worker_count: int, log_level: int = logging.INFO) -> NoReturn:
+        if worker_count < 1 or shard_count < worker_count:
+            raise ValueError("There must be at least one worker and at least one shard per worker.")
+        self.token = token
+        self.shard_count = shard_count
+        self.worker_count = worker_count
+        self.log_level = log_level
+        self.context = multiprocessing.get_context("spawn")
+        self.workers = {}
+        self.started_at = {}
+        self.restart_at = {}
+        self.failures = {}
+        self.stopping = False
+
+    def shards_of(self, worker_index: int) -> list[int]:
+        """Returns the IDs of the shards run by the worker."""
+        return list(range(worker_index, self.shard_count, self.worker_count))
+
+    def start_worker(self, worker_index: int) -> NoReturn:
+        """Starts the worker's process."""
+        shard_ids = self.shards_of(worker_index)
+        process = self.context.Process(target=run_worker, name=f"shard-worker-{worker_index}", daemon=False,
+                                       args=(self.token, worker_index, shard_ids, self.shard_count, self.log_level))
+        process.start()
+        self.workers[worker_index] = process
+        self.started_at[worker_index] = time.monotonic()
+        logging.info("Started worker %s (PID %s) with shards %s of %s.", worker_index, process.pid, shard_ids,
+                     self.shard_count)
+
+    def run(self) -> NoReturn:
+        """Starts every worker and keeps them running until the supervisor is interrupted or terminated."""
+        signal.signal(signal.SIGINT, self.request_stop)
+        signal.signal(signal.SIGTERM, self.request_stop)
+        now = time.monotonic()
+        shards_per_worker = -(-self.shard_count // self.worker_count)
+        for worker_index in range(self.worker_count):
+            self.restart_at[worker_index] = now + worker_index * shards_per_worker * self.IDENTIFY_INTERVAL_SECONDS
+        try:
+            while not self.stopping:
+                self.check_workers()
+                time.sleep(self.POLL_INTERVAL_SECONDS)
+        finally:
+            self.stop_workers()
+
+    def request_stop(self, signum: int, frame) -> NoReturn:
+        logging.info("Received signal %s, stopping the workers.", signum)
+        self.stopping = True
+
+    def check_workers(self) -> NoReturn:
+        """Schedules a restart for every worker that exited and starts the workers that are due."""
+        now = time.monotonic()
+        for worker_index, process in list(self.workers.items()):
+            if process.is_alive():
+                continue
+            del self.workers[worker_index]
+            if now - self.started_at[worker_index] >= self.STABLE_UPTIME_SECONDS:
+                self.failures[worker_index] = 0
+            failures = self.failures.get(worker_index, 0)
+            delay = min(self.RESTART_BASE_DELAY_SECONDS * 2 ** failures, self.RESTART_MAX_DELAY_SECONDS)
+            self.failures[worker_index] = failures + 1
+            self.restart_at[worker_index] = now + delay
+            logging.error("Worker %s exited with code %s, restarting it in %ss.", worker_index, process.exitcode, delay)
+        for worker_index, restart_at in list(self.restart_at.items()):
+            if restart_at <= now:
+                del self.restart_at[worker_index]
+                self.start_worker(worker_index)
+
+    def stop_workers(self) -> NoReturn:
+        """Asks every worker to close its connection and save its state, killing those that don't exit in time."""
+        for process in self.workers.values():
+            if process.is_alive():
+                if os.name == "posix":
+                    os.kill(process.pid, signal.SIGINT)
+                else:
+                    process.terminate()
+        deadline = time.monotonic() + self.SHUTDOWN_TIMEOUT_SECONDS
+        for process in self.workers.values():
+            process.join(max(deadline - time.monotonic(), 0))
+            if process.is_alive():
+                logging.error("Worker %s did not stop in time and was killed.", process.name)
+                process.kill()
+                process.join()
+        self.workers = {}
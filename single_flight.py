@@ -0,0 +1,56 @@
+import random
+import asyncio
+from typing import Awaitable, Callable, Hashable, NoReturn
+from metrics import COALESCED_SEARCHES
+
+
+class Flight:
+    """A search in progress and the number of callers waiting for its results."""
+    __slots__ = ("task", "callers")
+
+    def __init__(self, task: asyncio.Task) -> NoReturn:
+        self.task = task
+        self.callers = 0
+
+
+class SingleFlight:
+    """Coalesces concurrent searches for the same key into a single search whose results are split between the
+    callers.
+
+    The first caller for a key starts the search in its own task, so cancelling a caller doesn't cancel it for the
+    others. Callers that arrive while it's running wait for it instead of starting their own. Once it's done, its
+    results are shuffled and every caller gets every n-th of them, so callers never get the same result. Errors are
+    raised to every caller.
+
+    Attributes:
+        flights (dict[Hashable, Flight]): The searches in progress, keyed by what they search for.
+    """
+    def __init__(self) -> NoReturn:
+        self.flights = {}
+
+    async def do(self, key: Hashable, search: Callable[[], Awaitable[list]]) -> tuple[list, int]:
+        """Runs the search, or joins the one already running for the key.
+
+        Returns:
+            tuple[list, int]: The caller's share of the results, and the total number of results.
+        """
+        flight = self.flights.get(key)
+        if flight is None:
+            flight = Flight(asyncio.create_task(self.fly(key, search)))
+            self.flights[key] = flight
+            COALESCED_SEARCHES.inc(role="leader")
+        else:
+            COALESCED_SEARCHES.inc(role="follower")
+        index = flight.callers
+        flight.callers += 1
+        results = await asyncio.shield(flight.task)
+        return results[index::flight.callers], len(results)
+
+    async def fly(self, key: Hashable, search: Callable[[], Awaitable[list]]) -> list:
+        """Runs the search and stops new callers from joining it once it's done."""
+        try:
+            results = list(await search())
+        finally:
+            del self.flights[key]
+        random.shuffle(results)
+        return results
@@ -0,0 +1,37 @@
+from datetime import datetime, timezone, timedelta
+from author_index import AuthorIndex
+
+CHANNEL_ID = 1
+NOW = datetime(2024, 1, 1, tzinfo=timezone.utc)
+
+
+def make_index(messages_per_author: dict[str, int]) -> AuthorIndex:
+    index = AuthorIndex()
+    for name, count in messages_per_author.items():
+        for minute in range(count):
+            index.record(CHANNEL_ID, name, NOW - timedelta(minutes=minute))
+    return index
+
+
+def test_draw_finds_other_authors_when_the_excluded_one_dominates():
+    """The correct author sent 95% of the messages, which is when wrong answers are hardest to draw."""
+    messages_per_author = {"dominant": 190}
+    messages_per_author.update({f"author{number}": 1 for number in range(10)})
+    index = make_index(messages_per_author)
+    for _ in range(1000):
+        drawn = index.draw(CHANNEL_ID, 2, exclude={"dominant"})
+        assert len(drawn) == 2
+        assert len(set(drawn)) == 2
+        assert "dominant" not in drawn
+
+
+def test_draw_returns_every_remaining_author_when_there_are_too_few():
+    index = make_index({"dominant": 50, "other": 1})
+    assert index.draw(CHANNEL_ID, 2, exclude={"dominant"}) == ["other"]
+    assert index.draw(CHANNEL_ID, 2, exclude={"dominant", "other"}) == []
+
+
+def test_draw_follows_the_scores():
+    index = make_index({"correct": 1, "frequent": 9, "rare": 1})
+    draws = [index.draw(CHANNEL_ID, 1, exclude={"correct"})[0] for _ in range(2000)]
+    assert 0.85 <= draws.count("frequent") / len(draws) <= 0.95
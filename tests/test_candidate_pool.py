@@ -0,0 +1,44 @@
+import asyncio
+from collections import deque
+from types import SimpleNamespace
+import pytest
+
+pytest.importorskip("discord")
+
+from candidate_pool import CandidatePool
+from constants import KEY_GUILD_NAME, KEY_SELECT_FROM
+
+GUILD_ID = 1
+
+
+class StubRandomMessage:
+    """Finds the same few candidates on every search, like a small source channel does."""
+    def __init__(self, message_ids: list[int]) -> None:
+        self.message_ids = message_ids
+
+    async def find_candidates(self, guild_id: int, config: dict, keywords: frozenset[str] = frozenset()) -> list:
+        return [SimpleNamespace(id=message_id) for message_id in self.message_ids]
+
+
+class StubConfigManager:
+    def load_guild_config(self, guild_id: int) -> dict:
+        return {KEY_SELECT_FROM: "2", KEY_GUILD_NAME: "guild"}
+
+
+async def take(message_ids: list[int], pooled_ids: list[int], count: int) -> list[int]:
+    pool = CandidatePool(StubRandomMessage(message_ids), StubConfigManager())
+    pool.pools[GUILD_ID] = deque((SimpleNamespace(id=message_id) for message_id in pooled_ids), maxlen=pool.MAX_SIZE)
+    candidates = await pool.take(GUILD_ID, count)
+    pool.close()
+    return [candidate.id for candidate in candidates]
+
+
+def test_take_does_not_return_a_message_twice():
+    taken_ids = asyncio.run(take([0, 1], pooled_ids=[0], count=3))
+    assert sorted(taken_ids) == [0, 1]
+
+
+def test_take_returns_count_different_messages():
+    taken_ids = asyncio.run(take(list(range(10)), pooled_ids=[0, 1], count=5))
+    assert len(taken_ids) == 5
+    assert len(set(taken_ids)) == 5
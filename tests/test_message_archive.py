@@ -0,0 +1,94 @@
+import random
+import asyncio
+from datetime import datetime, timezone, timedelta
+import pytest
+
+pytest.importorskip("discord")
+
+from author_index import AuthorIndex
+from message_archive import MessageArchive
+from message_histogram import HistogramStore
+from constants import KEY_SELECT_FROM, KEY_ENABLE_URLS, KEY_ENABLE_ATTACHMENTS, KEY_ENABLE_MENTIONS
+from benchmark import FakeBackend, FakeUser, FakeGuild, FakeChannel, FakeMessage
+
+BOT = FakeUser(1, "bot")
+AUTHOR = FakeUser(2, "author")
+START = datetime(2024, 1, 1, tzinfo=timezone.utc)
+
+
+def make_archive(directory) -> MessageArchive:
+    return MessageArchive(HistogramStore(str(directory / "histograms.json")), AuthorIndex(),
+                          str(directory / "archive.db"))
+
+
+def make_channel(backend: FakeBackend) -> FakeChannel:
+    return FakeChannel(backend, 10, "source", FakeGuild(20, "guild", BOT))
+
+
+def post(backend: FakeBackend, channel: FakeChannel, created_at: datetime) -> FakeMessage:
+    """Adds a message to the channel's history, as if it had been sent in it."""
+    message = FakeMessage(backend, backend.new_id(), channel, AUTHOR, "hello", created_at)
+    channel.messages.append(message)
+    channel.index_history()
+    return message
+
+
+def test_live_messages_do_not_skip_messages_sent_while_offline(tmp_path):
+    async def run():
+        backend = FakeBackend(api_latency=0)
+        channel = make_channel(backend)
+        for minute in range(5):
+            post(backend, channel, START + timedelta(minutes=minute))
+        archive = make_archive(tmp_path)
+        archive.start_backfill(channel)
+        await archive.backfill_tasks[channel.id]
+        archive.close()
+
+        # While the bot is offline
+        for minute in range(5, 11):
+            post(backend, channel, START + timedelta(minutes=minute))
+
+        archive = make_archive(tmp_path)
+        archive.start_backfill(channel)
+        # A message arrives before the catch-up backfill gets its turn
+        archive.add(post(backend, channel, START + timedelta(minutes=11)))
+        await archive.backfill_tasks[channel.id]
+        count = archive.count_messages(channel.id)
+
+        archive.add(post(backend, channel, START + timedelta(minutes=12)))
+        archive.close()
+        archive = make_archive(tmp_path)
+        archive.start_backfill(channel)
+        await archive.backfill_tasks[channel.id]
+        return count, archive.count_messages(channel.id), backend.rest_calls["GET /channels/{channel_id}/messages"]
+
+    count_after_catch_up, count_after_restart, history_calls = asyncio.run(run())
+    assert count_after_catch_up == 12
+    assert count_after_restart == 13
+    # The first backfill and the catch-up read history, but the last backfill starts after the live message
+    assert history_calls == 2
+
+
+@pytest.mark.parametrize("keywords", [frozenset(), frozenset({"hello"})])
+def test_sample_draws_busy_days_in_proportion_to_their_messages(tmp_path, keywords):
+    """90% of the messages are sent in a burst of a few hours and 10% over the rest of a year, so about 90% of the
+    windows should start in the burst, rather than almost none if windows were drawn uniformly over time."""
+    async def run():
+        backend = FakeBackend(api_latency=0)
+        channel = make_channel(backend)
+        burst = START + timedelta(days=200)
+        dates = [burst + timedelta(seconds=random.uniform(0, 4 * 3600)) for _ in range(900)]
+        dates += [START + timedelta(seconds=random.uniform(0, 365 * 86400)) for _ in range(100)]
+        for created_at in sorted(dates):
+            post(backend, channel, created_at)
+        archive = make_archive(tmp_path)
+        archive.start_backfill(channel)
+        await archive.backfill_tasks[channel.id]
+        return archive, burst
+
+    archive, burst = asyncio.run(run())
+    config = {KEY_SELECT_FROM: "10", KEY_ENABLE_URLS: True, KEY_ENABLE_ATTACHMENTS: True, KEY_ENABLE_MENTIONS: True}
+    draws = [archive.sample(config, BOT.id, keywords, limit=1)[0] for _ in range(2000)]
+    archive.close()
+    in_burst = sum(burst <= message.created_at <= burst + timedelta(hours=4) for message in draws)
+    assert 0.8 <= in_burst / len(draws) <= 0.97